@@ -7,6 +7,7 @@
 //   maxDelay: 10000,
 //   backoffFactor: 1.7,
 //   jitter: 0.3, // 30% jitter
+//   heartbeatInterval: 25000, // keeps presence alive; 0 disables
 //   onSocketChange: (newSocket) => {},
 //   onReconnectAttempt: ({ attempt, delayMs }) => {},
 //   onReconnectStop: (reason) => {},
@@ -30,6 +31,7 @@ export function connectToWebSocket(
     maxDelay = 10000,
     backoffFactor = 1.7,
     jitter = 0.3,
+    heartbeatInterval = 25000,
     onSocketChange,
     onReconnectAttempt,
     onReconnectStop,
@@ -38,6 +40,7 @@ export function connectToWebSocket(
 
   let attempt = 0;
   let forcedClose = false;
+  let heartbeatTimer = null;
   // (removed unused variable)
 
   function applyJitter(baseMs) {
@@ -52,7 +55,9 @@ export function connectToWebSocket(
   }
 
   function openSocket() {
-    const socket = new WebSocket(`${wsBase}/chat/${roomName}/`);
+    // The access token travels as a subprotocol pair since browsers cannot set headers
+    const protocols = token ? ['bearer', token] : undefined;
+    const socket = new WebSocket(`${wsBase}/chat/${roomName}/`, protocols);
 // (variable removed – was unused)
     if (typeof onSocketChange === 'function') {
       onSocketChange(socket);
@@ -61,13 +66,13 @@ export function connectToWebSocket(
     socket.onopen = (event) => {
       console.log('WebSocket connection established');
       attempt = 0; // reset attempts on successful connect
-      // Send authentication token if provided
-      if (token) {
-        try {
-          socket.send(JSON.stringify({ type: 'auth', token }));
-        } catch (e) {
-          console.error('Error sending auth token:', e);
-        }
+      // The server expires presence for connections that stop sending frames
+      if (heartbeatInterval > 0) {
+        heartbeatTimer = setInterval(() => {
+          if (socket.readyState === WebSocket.OPEN) {
+            socket.send(JSON.stringify({ type: 'heartbeat' }));
+          }
+        }, heartbeatInterval);
       }
       if (typeof onOpen === 'function') {
         onOpen(event);
@@ -88,6 +93,7 @@ export function connectToWebSocket(
 
     socket.onclose = (event) => {
       console.log('WebSocket connection closed:', event);
+      clearInterval(heartbeatTimer);
       if (typeof onClose === 'function') {
         onClose(event);
       }
@@ -0,0 +1,180 @@
+import bisect
+import gzip
+import json
+import os
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import TruncMonth
+
+from .cache import LRUCache
+from .history import invalidate_room
+from .models import ArchivedFile, ArchiveSegment, ChatMessage, ChatRoom, Notification
+from .search import unindex_messages
+
+# Message fields kept in segment files
+ARCHIVED_FIELDS = [
+    'id', 'user_id', 'message', 'message_type', 'file', 'file_name', 'file_size', 'mime_type', 'thumbnails', 'timestamp'
+]
+
+# Decoded segments keyed by path: (updated_at, sort keys, records)
+segment_cache = LRUCache(maxsize=getattr(settings, 'CHAT_ARCHIVE_CACHE_SEGMENTS', 64))
+
+
+def archive_root():
+    return getattr(settings, 'CHAT_ARCHIVE_ROOT', settings.BASE_DIR / 'archive')
+
+
+def segment_name(room_id, month):
+    return f'{room_id}/{month:%Y-%m}.jsonl.gz'
+
+
+def write_segment(path, records):
+    """Atomically write records as gzip-compressed JSON lines"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial_path = f'{path}.tmp'
+    with gzip.open(partial_path, 'wt', encoding='utf-8') as segment:
+        for record in records:
+            segment.write(json.dumps(record, separators=(',', ':')))
+            segment.write('\n')
+    os.replace(partial_path, path)
+
+
+def read_segment(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as segment:
+        return [json.loads(line) for line in segment]
+
+
+def serialize_message(chat_message):
+    record = {field: getattr(chat_message, field) for field in ARCHIVED_FIELDS}
+    record['file'] = chat_message.file.name or None
+    record['timestamp'] = chat_message.timestamp.isoformat()
+    record['username'] = chat_message.username
+    return record
+
+
+def archive_room_month(room_id, month, messages):
+    """Move ``messages`` (one room, one month) into that month's segment.
+
+    Messages already in the segment are merged in, so re-running after an
+    interrupted archive does not duplicate anything. The messages are deleted
+    without ``post_delete`` handlers: archived messages keep their attachment
+    references, recorded as ``ArchivedFile`` rows so room members can still
+    fetch them, and only their search index and recent history entries are
+    dropped.
+    """
+    if not messages:
+        return 0
+    segment = ArchiveSegment.objects.filter(room_id=room_id, month=month).first()
+    name = segment.path if segment else segment_name(room_id, month)
+    path = os.path.join(archive_root(), name)
+
+    records = {record['id']: record for record in (read_segment(path) if segment else [])}
+    records.update((chat_message.id, serialize_message(chat_message)) for chat_message in messages)
+    ordered = sorted(records.values(), key=lambda record: (datetime.fromisoformat(record['timestamp']), record['id']))
+    write_segment(path, ordered)
+
+    message_ids = [chat_message.id for chat_message in messages]
+    with transaction.atomic():
+        segment, _ = ArchiveSegment.objects.update_or_create(
+            room_id=room_id,
+            month=month,
+            defaults={
+                'path': name,
+                'message_count': len(ordered),
+                'first_timestamp': datetime.fromisoformat(ordered[0]['timestamp']),
+                'last_timestamp': datetime.fromisoformat(ordered[-1]['timestamp']),
+            }
+        )
+        ArchivedFile.objects.bulk_create(
+            [ArchivedFile(segment=segment, file=file) for file in {record['file'] for record in ordered} if file],
+            ignore_conflicts=True
+        )
+        Notification.objects.filter(related_message_id__in=message_ids).update(related_message=None)
+        unindex_messages(messages)
+        queryset = ChatMessage.objects.filter(id__in=message_ids)
+        queryset._raw_delete(queryset.db)
+        invalidate_room(ChatRoom.objects.values_list('name', flat=True).get(id=room_id))
+    segment_cache.invalidate(path)
+    return len(messages)
+
+
+def load_segment(segment):
+    """Return ``(keys, records)`` of a segment, sorted by ``(timestamp, id)``"""
+    path = segment.full_path
+    cached = segment_cache.get(path)
+    if cached is not None and cached[0] == segment.updated_at:
+        return cached[1], cached[2]
+    records = read_segment(path)
+    for record in records:
+        record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+    keys = [(record['timestamp'], record['id']) for record in records]
+    segment_cache.set(path, (segment.updated_at, keys, records))
+    return keys, records
+
+
+def to_message(room_id, record):
+    """Rebuild an unsaved ``ChatMessage`` from a segment record for serializers"""
+    fields = dict(record)
+    username = fields.pop('username')
+    chat_message = ChatMessage(room_id=room_id, **fields)
+    chat_message.username = username
+    return chat_message
+
+
+def messages_before(room_id, position, limit):
+    """Archived messages older than ``(timestamp, id)``, oldest first.
+
+    ``position`` None means from the newest archived message. Returns
+    ``(messages, has_more)``.
+    """
+    segments = ArchiveSegment.objects.filter(room_id=room_id).order_by('-month')
+    if position is not None:
+        segments = segments.filter(first_timestamp__lte=position[0])
+    collected = []
+    for segment in segments:
+        keys, records = load_segment(segment)
+        end = len(keys) if position is None else bisect.bisect_left(keys, position)
+        collected[:0] = records[max(end - limit - 1 + len(collected), 0):end]
+        if len(collected) > limit:
+            break
+    has_more = len(collected) > limit
+    return [to_message(room_id, record) for record in collected[max(len(collected) - limit, 0):]], has_more
+
+
+def messages_after(room_id, position, limit):
+    """Archived messages newer than ``(timestamp, id)``, oldest first; ``(messages, has_more)``"""
+    segments = ArchiveSegment.objects.filter(
+        room_id=room_id, last_timestamp__gte=position[0]
+    ).order_by('month')
+    collected = []
+    for segment in segments:
+        keys, records = load_segment(segment)
+        start = bisect.bisect_right(keys, position)
+        collected.extend(records[start:start + limit + 1 - len(collected)])
+        if len(collected) > limit:
+            break
+    has_more = len(collected) > limit
+    return [to_message(room_id, record) for record in collected[:limit]], has_more
+
+
+def archivable_months(cutoff, room_id=None):
+    """``(room_id, month)`` pairs that have messages older than ``cutoff``"""
+    queryset = ChatMessage.objects.filter(timestamp__lt=cutoff)
+    if room_id is not None:
+        queryset = queryset.filter(room_id=room_id)
+    months = queryset.annotate(month=TruncMonth('timestamp')).values_list('room_id', 'month').distinct()
+    return sorted((room_id, month.date()) for room_id, month in months.order_by())
+
+
+def archivable_messages(cutoff, room_id, month):
+    """A room's messages of ``month`` older than ``cutoff``, with the fields segments need"""
+    start = datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+    end = datetime(month.year + month.month // 12, month.month % 12 + 1, 1, tzinfo=timezone.utc)
+    return ChatMessage.objects.filter(
+        room_id=room_id, timestamp__gte=start, timestamp__lt=min(end, cutoff)
+    ).annotate(username=F('user__username')).only(
+        'id', 'room_id', *ARCHIVED_FIELDS[1:]
+    ).order_by('timestamp', 'id')
@@ -0,0 +1,17 @@
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+
+class QueryParamJWTAuthentication(JWTAuthentication):
+    """Accept an access token in the ``token`` query parameter.
+
+    Lets media URLs be used directly in ``<img>``, ``<video>`` and ``<audio>``
+    elements, which cannot send an Authorization header.
+    """
+    query_param = 'token'
+
+    def authenticate(self, request):
+        raw_token = request.query_params.get(self.query_param)
+        if not raw_token:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return self.get_user(validated_token), validated_token
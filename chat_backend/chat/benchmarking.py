@@ -0,0 +1,128 @@
+"""Measurement helpers shared by the benchmark management commands"""
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+from datetime import datetime, timezone
+
+import django
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of ``values``; None when empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def latency_summary(seconds):
+    """p50/p99/max of a list of durations, in milliseconds"""
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+    return {
+        'p50_ms': ms(percentile(seconds, 0.50)),
+        'p99_ms': ms(percentile(seconds, 0.99)),
+        'max_ms': ms(max(seconds) if seconds else None),
+        'samples': len(seconds),
+    }
+
+
+def rss_bytes(pid=None):
+    """Resident set size of a process, from /proc where available"""
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid is None:
+        # Peak rather than current RSS; kilobytes on Linux, bytes on macOS
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == 'darwin' else usage * 1024
+    return None
+
+
+class QueryCounter:
+    """Counts SQL statements on every database connection, in every thread.
+
+    Consumers run their queries on ``database_sync_to_async`` worker threads,
+    each with its own connection, so the wrapper is attached to connections as
+    they are created as well as to the ones already open.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def _attach(self, connection):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def _on_connection_created(self, sender, connection, **kwargs):
+        self._attach(connection)
+
+    def install(self):
+        connection_created.connect(self._on_connection_created)
+        for connection in connections.all():
+            self._attach(connection)
+
+    def uninstall(self):
+        connection_created.disconnect(self._on_connection_created)
+        for connection in connections.all():
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+    def reset(self):
+        with self._lock:
+            count, self.count = self.count, 0
+        return count
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True, timeout=5
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment():
+    """Context stored with every result file so runs can be compared"""
+    return {
+        'revision': git_revision(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'database': connections['default'].vendor,
+    }
+
+
+def write_results(path, benchmark, parameters, results):
+    """Write a benchmark run as JSON and return the document"""
+    document = {
+        'benchmark': benchmark,
+        'environment': environment(),
+        'parameters': parameters,
+        'results': results,
+    }
+    with open(path, 'w') as output:
+        json.dump(document, output, indent=2)
+    return document
@@ -0,0 +1,77 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import ChatRoom
+
+
+class LRUCache:
+    """Small thread-safe, size-bounded mapping with least-recently-used eviction.
+
+    Shared between the event loop and the ``database_sync_to_async`` worker
+    threads, so every operation takes the lock.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Process-local room name -> id mapping used on the consumer hot path
+room_cache = LRUCache(maxsize=getattr(settings, 'CHAT_ROOM_CACHE_SIZE', 10000))
+
+
+def get_room_id(room_name, create=False):
+    """Resolve a room name to its id, consulting the cache first.
+
+    Returns None when the room does not exist and ``create`` is False.
+    """
+    room_id = room_cache.get(room_name)
+    if room_id is not None:
+        return room_id
+
+    if create:
+        room, _ = ChatRoom.objects.get_or_create(name=room_name)
+        room_id = room.id
+    else:
+        room_id = ChatRoom.objects.filter(name=room_name).values_list('id', flat=True).first()
+        if room_id is None:
+            return None
+
+    room_cache.set(room_name, room_id)
+    return room_id
+
+
+@receiver(post_delete, sender=ChatRoom)
+def invalidate_room_cache(sender, instance, **kwargs):
+    room_cache.invalidate(instance.name)
@@ -0,0 +1,65 @@
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Subprotocol a client offers to switch the connection to MessagePack frames
+MSGPACK_SUBPROTOCOL = 'msgpack'
+
+
+def negotiate_encoding(subprotocols):
+    """Return ``'msgpack'`` when the client offered it and it is available, else ``'json'``"""
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in (subprotocols or []):
+        return 'msgpack'
+    return 'json'
+
+
+def encode(data, encoding):
+    """Serialize a frame for one socket.
+
+    Returns ``(text_data, bytes_data)`` ready to be passed to ``send``.
+    """
+    if encoding == 'msgpack':
+        return None, msgpack.packb(data, use_bin_type=True)
+    return json.dumps(data), None
+
+
+def decode(text_data=None, bytes_data=None):
+    """Parse an inbound frame; raises ValueError when it is malformed"""
+    if bytes_data is not None:
+        if msgpack is None:
+            raise ValueError('Binary frames are not supported')
+        return msgpack.unpackb(bytes_data, raw=False)
+    return json.loads(text_data)
+
+
+def encode_broadcast(data):
+    """Pre-encode a group event once, as JSON text.
+
+    The result is merged into the ``group_send`` event. JSON connections
+    forward it as-is; MessagePack connections convert it in
+    ``broadcast_frame``, so the event crossing the channel layer carries a
+    single encoding whatever the room's mix of connections.
+    """
+    return {'text': json.dumps(data)}
+
+
+# Last broadcast converted to MessagePack, as (text, bytes); every
+# MessagePack connection of the room in this process reuses it
+_packed = (None, None)
+
+
+def broadcast_frame(event, encoding):
+    """Pick the frame for this connection from a group event"""
+    global _packed
+    if encoding == 'msgpack':
+        if 'bytes' in event:
+            return None, event['bytes']
+        text, packed = _packed
+        if text != event['text']:
+            packed = msgpack.packb(json.loads(event['text']), use_bin_type=True)
+            _packed = (event['text'], packed)
+        return None, packed
+    return event['text'], None
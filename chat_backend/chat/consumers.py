@@ -1,21 +1,82 @@
-import json
 import logging
 import traceback
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
-from rest_framework_simplejwt.tokens import AccessToken
-from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
-from .models import ChatRoom, ChatMessage, UserRoom, Notification, UserPresence
-
-User = get_user_model()
+from .models import Attachment, ChatMessage, UserRoom, Notification, NotificationCounter
+from . import codecs, metrics, tracing
+from .cache import get_room_id
+from .codecs import MSGPACK_SUBPROTOCOL, negotiate_encoding
+from .history import recent_history
+from .media import media_url
+from .metrics import database_sync_to_async
+from .persistence import get_message_batcher, write_behind_enabled
+from .presence import get_presence_tracker
+from .ratelimit import get_rate_limiter, rate_limits_enabled, retry_after_hint
+from .search import index_messages
+from .thumbnails import get_thumbnail_pipeline, thumbnail_urls, thumbnails_enabled
 
 # Set up loggers
 logger = logging.getLogger('chat.websocket')
 security_logger = logging.getLogger('chat.security')
+# Lines written for every message; sampled in production (see LOGGING)
+message_logger = logging.getLogger('chat.websocket.messages')
+
+# Message types carrying a file, and limits of the columns file info is copied to
+FILE_MESSAGE_TYPES = {value for value, _ in ChatMessage.MESSAGE_TYPES} - {'text'}
+FILE_NAME_MAX_LENGTH = ChatMessage._meta.get_field('file_name').max_length
+MIME_TYPE_MAX_LENGTH = ChatMessage._meta.get_field('mime_type').max_length
+FILE_SIZE_MAX = 2 ** 31 - 1
+
+
+def file_info_error(file_info):
+    """Return why ``file_info`` cannot be stored on a message, or None"""
+    file_name = file_info.get('file_name')
+    if not isinstance(file_name, str) or len(file_name) > FILE_NAME_MAX_LENGTH:
+        return f'File name must be a string of at most {FILE_NAME_MAX_LENGTH} characters'
+    mime_type = file_info.get('mime_type')
+    if mime_type is not None and (not isinstance(mime_type, str) or len(mime_type) > MIME_TYPE_MAX_LENGTH):
+        return f'MIME type must be a string of at most {MIME_TYPE_MAX_LENGTH} characters'
+    file_size = file_info.get('file_size')
+    if file_size is not None and (
+        not isinstance(file_size, int) or isinstance(file_size, bool) or not 0 <= file_size <= FILE_SIZE_MAX
+    ):
+        return 'File size must be a non-negative integer'
+    return None
+
+
+def build_message_data(chat_message, username):
+    """Build the client-facing representation of a saved message"""
+    message_data = {
+        'type': 'chat_message',
+        'message': chat_message.message,
+        'username': username,
+        'timestamp': chat_message.timestamp.isoformat(),
+        'message_id': chat_message.id,
+        'message_type': chat_message.message_type
+    }
+
+    # Add file information if it's a file message
+    if chat_message.message_type != 'text':
+        message_data['file_name'] = chat_message.file_name
+        message_data['file_size'] = chat_message.file_size
+        message_data['mime_type'] = chat_message.mime_type
+        if chat_message.file:
+            message_data['file_url'] = media_url(chat_message.file.name)
+        if chat_message.thumbnails:
+            message_data['thumbnails'] = thumbnail_urls(chat_message.thumbnails)
+
+    return message_data
+
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    # Frame encoding negotiated in connect
+    encoding = 'json'
+    # Whether the last frame was refused by a rate limit
+    throttled = False
+
     async def connect(self):
         try:
             # Extract room name from URL
@@ -24,32 +85,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
             
             logger.info(f"WebSocket connection attempt for room: {self.room_name}")
             
-            # Get user from scope
+            # User is resolved from the session or a JWT by JWTAuthMiddleware
             self.user = self.scope.get("user", AnonymousUser())
-            
-            # If user is anonymous, try to authenticate via JWT token
-            if self.user.is_anonymous:
-                headers = dict(self.scope.get('headers', []))
-                auth_header = headers.get(b'authorization', b'').decode('utf-8')
-                
-                if auth_header.startswith('Bearer '):
-                    token = auth_header.split(' ')[1]
-                    try:
-                        access_token = AccessToken(token)
-                        user_id = access_token['user_id']
-                        self.user = await self.get_user(user_id)
-                        logger.info(f"JWT authentication successful for user_id: {user_id}")
-                    except Exception as e:
-                        logger.error(f"JWT token validation error: {str(e)}")
-                        security_logger.warning(f"Failed JWT authentication attempt: {str(e)}")
-                        await self.close(code=4401, reason="Authentication failed")
-                        return
-                else:
-                    logger.warning("No valid authentication header provided")
-                    security_logger.warning("Anonymous WebSocket connection attempt without authentication")
-                    await self.close(code=4401, reason="Authentication required")
-                    return
-            
+
             # Only allow authenticated users to connect
             if self.user.is_anonymous:
                 logger.warning("Anonymous user attempted to connect")
@@ -60,8 +98,11 @@ class ChatConsumer(AsyncWebsocketConsumer):
             # Log successful authentication
             logger.info(f"User {self.user.username} authenticated successfully")
             
+            # Resolve the room once for the life of the connection
+            self.room_id = await self.resolve_room_id()
+
             # Update user presence
-            await self.update_user_presence(True, self.room_name)
+            await self.update_user_presence(True)
 
             # Join room group
             await self.channel_layer.group_add(
@@ -71,7 +112,26 @@ class ChatConsumer(AsyncWebsocketConsumer):
             
             logger.info(f"User {self.user.username} joined room group: {self.room_group_name}")
 
-            await self.accept()
+            # This connection now feeds the room's recent history buffer
+            recent_history.attach(self.room_name)
+            self.history_attached = True
+
+            # Per-user group for pushes such as unread notification counts
+            self.user_group_name = f'user_{self.user.id}'
+            await self.channel_layer.group_add(
+                self.user_group_name,
+                self.channel_name
+            )
+
+            # Clients may negotiate MessagePack frames; JSON is the default
+            self.encoding = negotiate_encoding(self.scope.get('subprotocols'))
+            if self.encoding == 'msgpack':
+                await self.accept(subprotocol=MSGPACK_SUBPROTOCOL)
+            else:
+                await self.accept(subprotocol=self.scope.get('auth_subprotocol'))
+            metrics.websocket_connections.inc()
+            metrics.websocket_room_connections.labels(self.room_name).inc()
+            self.counted = True
             
             # Send connection confirmation
             connection_message = {
@@ -80,8 +140,11 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'username': self.user.username
             }
             
-            await self.send(text_data=json.dumps(connection_message))
+            await self.send_frame(connection_message)
             logger.info(f"Connection accepted for user {self.user.username} in room {self.room_name}")
+
+            # Send the last screen of messages from the in-memory buffer
+            await self.send_recent_history()
             
         except KeyError as e:
             logger.error(f"Missing required parameter in WebSocket connection: {str(e)}")
@@ -95,15 +158,33 @@ class ChatConsumer(AsyncWebsocketConsumer):
         """Handle WebSocket disconnection"""
         try:
             logger.info(f"WebSocket disconnect for user {getattr(self, 'user', 'unknown')} from room {getattr(self, 'room_name', 'unknown')}, close_code: {close_code}")
-            
+
+            if getattr(self, 'counted', False):
+                self.counted = False
+                metrics.websocket_connections.dec()
+                room_connections = metrics.websocket_room_connections.labels(self.room_name)
+                room_connections.dec()
+                if room_connections.value <= 0:
+                    metrics.websocket_room_connections.remove(self.room_name)
+            
+            if getattr(self, 'history_attached', False):
+                self.history_attached = False
+                recent_history.detach(self.room_name)
+
             # Leave room group if it exists
             if hasattr(self, 'room_group_name') and hasattr(self, 'channel_name'):
                 await self.channel_layer.group_discard(
                     self.room_group_name,
                     self.channel_name
                 )
-                # Update user presence
-                await self.update_user_presence(False, None)
+                if hasattr(self, 'user_group_name'):
+                    await self.channel_layer.group_discard(
+                        self.user_group_name,
+                        self.channel_name
+                    )
+                # Update user presence for connections that got past authentication
+                if hasattr(self, 'user') and not self.user.is_anonymous:
+                    await self.update_user_presence(False)
                 logger.info(f"User {getattr(self, 'user', 'unknown')} left room group: {self.room_group_name}")
             else:
                 logger.warning("Disconnect called but room_group_name or channel_name not set")
@@ -112,71 +193,28 @@ class ChatConsumer(AsyncWebsocketConsumer):
             logger.error(f"Error during WebSocket disconnect: {str(e)}")
             logger.error(traceback.format_exc())
 
-    async def create_notification(self, recipient_id, notification_type, title, message, related_message_id=None, room_name=None):
-        """Create a notification for a user"""
+    async def update_user_presence(self, is_online):
+        """Register or release this connection in the presence store"""
         try:
-            await self.save_notification(
-                recipient_id=recipient_id,
-                sender_id=self.user.id if self.user else None,
-                notification_type=notification_type,
-                title=title,
-                message=message,
-                related_message_id=related_message_id,
-                room_name=room_name
-            )
-            logger.info(f"Notification created: {notification_type} for user {recipient_id}")
-        except Exception as e:
-            logger.error(f"Error creating notification: {str(e)}")
-
-    async def update_user_presence(self, is_online, current_room):
-        """Update user presence status"""
-        try:
-            await self.save_user_presence(
-                user_id=self.user.id,
-                is_online=is_online,
-                current_room=current_room
-            )
+            tracker = get_presence_tracker()
+            if is_online:
+                await tracker.connect(self.user.id, self.channel_name, self.room_name)
+            else:
+                await tracker.disconnect(self.user.id, self.channel_name)
             logger.info(f"User presence updated: {self.user.username} - online: {is_online}")
         except Exception as e:
             logger.error(f"Error updating user presence: {str(e)}")
 
     @database_sync_to_async
-    def save_notification(self, recipient_id, sender_id, notification_type, title, message, related_message_id=None, room_name=None):
-        """Save notification to database"""
-        notification = Notification.objects.create(
-            recipient_id=recipient_id,
-            sender_id=sender_id,
-            notification_type=notification_type,
-            title=title,
-            message=message,
-            related_message_id=related_message_id,
-            room_name=room_name
-        )
-        return notification
-
-    @database_sync_to_async
-    def save_user_presence(self, user_id, is_online, current_room):
-        """Save user presence to database"""
-        UserPresence.objects.update_or_create(
-            user_id=user_id,
-            defaults={
-                "is_online": is_online,
-                "current_room": current_room
-            }
-        )
+    def resolve_room_id(self, create=False):
+        """Look up the current room id through the process-local room cache"""
+        return get_room_id(self.room_name, create=create)
 
     @database_sync_to_async
-    def save_message(self, message, room_name, message_type='text', file_info=None):
+    def save_message(self, message, room_id, message_type='text', file_info=None):
         """Save message to database"""
-        try:
-            room = ChatRoom.objects.get(name=room_name)
-        except ChatRoom.DoesNotExist:
-            # Create the room if it doesn't exist
-            room = ChatRoom.objects.create(name=room_name)
-            logger.info(f"Created new room: {room_name}")
-        
-        chat_message = ChatMessage.objects.create(
-            room=room,
+        chat_message = ChatMessage(
+            room_id=room_id,
             user=self.user,
             message=message,
             message_type=message_type
@@ -187,148 +225,330 @@ class ChatConsumer(AsyncWebsocketConsumer):
             chat_message.file_name = file_info.get('file_name')
             chat_message.file_size = file_info.get('file_size')
             chat_message.mime_type = file_info.get('mime_type')
-            chat_message.save()
+            Attachment.link([chat_message], [file_info])
         
+        with transaction.atomic():
+            chat_message.save()
+            index_messages([chat_message])
         return chat_message
 
-    async def receive(self, text_data):
+    @database_sync_to_async
+    def save_messages(self, messages):
+        """Save several messages in one transaction"""
+        chat_messages = []
+        for message, message_type, file_info in messages:
+            chat_message = ChatMessage(
+                room_id=self.room_id,
+                user=self.user,
+                message=message,
+                message_type=message_type
+            )
+            if file_info:
+                chat_message.file_name = file_info.get('file_name')
+                chat_message.file_size = file_info.get('file_size')
+                chat_message.mime_type = file_info.get('mime_type')
+            chat_messages.append(chat_message)
+
+        with transaction.atomic():
+            Attachment.link(chat_messages, [file_info for _, _, file_info in messages])
+            chat_messages = ChatMessage.objects.bulk_create(chat_messages)
+            index_messages(chat_messages)
+            return chat_messages
+
+    async def websocket_receive(self, message):
+        metrics.frames_in.inc()
+        with metrics.receive_seconds.time(), tracing.trace('receive', room=self.room_name):
+            await super().websocket_receive(message)
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        if text_data is not None or bytes_data is not None:
+            metrics.frames_out.inc()
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+
+    async def group_send(self, event):
+        """Send an event to this room's group, carrying the current trace"""
+        context = tracing.current_context()
+        if context is not None:
+            event['trace'] = context
+        with metrics.group_send_seconds.time(), tracing.span('group_send'):
+            await self.channel_layer.group_send(self.room_group_name, event)
+
+    async def send_frame(self, data):
+        """Send a frame to this socket in the negotiated encoding"""
+        text_data, bytes_data = codecs.encode(data, self.encoding)
+        await self.send(text_data=text_data, bytes_data=bytes_data)
+
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            logger.info(f"Received message from user {self.user.username} in room {self.room_name}")
+            message_logger.info("Received message from user %s in room %s", self.user.username, self.room_name)
             
             # Validate input
-            if not text_data:
+            if not text_data and not bytes_data:
                 logger.warning("Empty message received")
-                await self.send(text_data=json.dumps({
+                await self.send_frame({
                     'type': 'error',
                     'message': 'Empty message received'
-                }))
+                })
                 return
             
-            # Parse JSON
+            # Parse JSON or MessagePack
             try:
-                text_data_json = json.loads(text_data)
-            except json.JSONDecodeError as e:
-                logger.error(f"Invalid JSON format from user {self.user.username}: {str(e)}")
-                await self.send(text_data=json.dumps({
+                with tracing.span('decode'):
+                    payload = codecs.decode(text_data, bytes_data)
+            except ValueError as e:
+                logger.error(f"Invalid frame format from user {self.user.username}: {str(e)}")
+                await self.send_frame({
                     'type': 'error',
-                    'message': 'Invalid JSON format'
-                }))
+                    'message': 'Invalid JSON format' if bytes_data is None else 'Invalid MessagePack format'
+                })
                 return
-            
-            # Extract message details
-            message = text_data_json.get('message', '').strip()
-            message_type = text_data_json.get('message_type', 'text')
-            file_info = text_data_json.get('file_info', None)
-            
-            # Validate based on message type
-            if message_type == 'text':
-                if not message:
-                    logger.warning(f"Empty message content from user {self.user.username}")
-                    await self.send(text_data=json.dumps({
-                        'type': 'error',
-                        'message': 'Message content cannot be empty'
-                    }))
-                    return
-                
-                # Validate message length
-                if len(message) > 1000:
-                    logger.warning(f"Message too long from user {self.user.username}: {len(message)} characters")
-                    await self.send(text_data=json.dumps({
+
+            # Heartbeats only refresh presence, so they cost no rate limit
+            # tokens and a busy client is never expired for being throttled
+            if isinstance(payload, dict) and payload.get('type') == 'heartbeat':
+                with tracing.span('presence'):
+                    await get_presence_tracker().heartbeat(self.user.id, self.channel_name, self.room_name)
+                return
+
+            if isinstance(payload, list):
+                max_operations = self.max_batch_operations()
+                if not payload or len(payload) > max_operations:
+                    await self.send_frame({
                         'type': 'error',
-                        'message': 'Message too long (max 1000 characters)'
-                    }))
+                        'message': f'Batch must contain between 1 and {max_operations} operations'
+                    })
                     return
-            else:
-                # File message validation
-                if not file_info or not file_info.get('file_name'):
-                    logger.warning(f"Invalid file info from user {self.user.username}")
-                    await self.send(text_data=json.dumps({
-                        'type': 'error',
-                        'message': 'File information is required for file messages'
-                    }))
+
+            # Throttle before any presence, database or fanout work; each
+            # operation of a batch costs a room and a batch token
+            if rate_limits_enabled():
+                operations = len(payload) if isinstance(payload, list) else None
+                with tracing.span('ratelimit'):
+                    wait = await get_rate_limiter().check(self.channel_name, self.user.id, self.room_name, operations)
+                if wait:
+                    await self.reject_throttled(wait)
                     return
+                self.throttled = False
+
+            # Any frame from the client counts as a presence heartbeat
+            with tracing.span('presence'):
+                await get_presence_tracker().heartbeat(self.user.id, self.channel_name, self.room_name)
+
+            # A list carries several operations in one frame
+            if isinstance(payload, list):
+                await self.receive_batch(payload)
+                return
+
+            if not isinstance(payload, dict):
+                await self.send_frame({
+                    'type': 'error',
+                    'message': 'Invalid message format'
+                })
+                return
+
+            with tracing.span('parse'):
+                message, message_type, file_info, error = self.parse_message(payload)
+            if error:
+                await self.send_frame({
+                    'type': 'error',
+                    'message': error
+                })
+                return
             
             # Log the message
             if message_type == 'text':
-                logger.info(f"User {self.user.username} sending message in room {self.room_name}: {message[:50]}...")
+                message_logger.info("User %s sending message in room %s: %s...", self.user.username, self.room_name, message[:50])
             else:
-                logger.info(f"User {self.user.username} sending {message_type} file in room {self.room_name}: {file_info.get('file_name', 'unknown')}")
+                message_logger.info("User %s sending %s file in room %s: %s", self.user.username, message_type, self.room_name, file_info.get('file_name', 'unknown'))
             
+            # Create the room on its first message
+            if self.room_id is None:
+                self.room_id = await self.resolve_room_id(create=True)
+                logger.info(f"Created new room: {self.room_name}")
+
             # Save message to database
-            chat_message = await self.save_message(message, self.room_name, message_type, file_info)
-            
-            # Send message to room group
-            message_data = {
-                'type': 'chat_message',
-                'message': message,
-                'username': self.user.username,
-                'timestamp': self.get_current_timestamp(),
-                'message_id': chat_message.id,
-                'message_type': message_type
-            }
-            
-            # Add file information if it's a file message
-            if message_type != 'text' and file_info:
-                message_data['file_name'] = file_info.get('file_name')
-                message_data['file_size'] = file_info.get('file_size')
-                message_data['mime_type'] = file_info.get('mime_type')
-            
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                message_data
-            )
-            
-            logger.info(f"Message broadcasted successfully from user {self.user.username}")
+            with tracing.span('save'):
+                if write_behind_enabled():
+                    chat_message = await get_message_batcher().submit(self.user, self.room_id, message, message_type, file_info)
+                else:
+                    chat_message = await self.save_message(message, self.room_id, message_type, file_info)
+            
+            # Encode the frame once here; recipients write it to their socket as-is
+            with tracing.span('encode'):
+                event = {
+                    'type': 'chat_message',
+                    'message_ids': [chat_message.id],
+                    **codecs.encode_broadcast(self.build_message_data(chat_message))
+                }
+            await self.group_send(event)
+            
+            message_logger.info("Message broadcasted successfully from user %s", self.user.username)
+
+            if thumbnails_enabled():
+                get_thumbnail_pipeline().schedule(self.room_group_name, [chat_message])
+
+            # Notify offline room members once per message
+            with tracing.span('notify'):
+                await self.create_notifications_for_offline_users([chat_message])
             
         except Exception as e:
             logger.error(f"Error processing message from user {self.user.username}: {str(e)}")
             logger.error(traceback.format_exc())
-            await self.send(text_data=json.dumps({
+            await self.send_frame({
                 'type': 'error',
                 'message': 'Internal server error while processing message'
-            }))
+            })
+
+    async def reject_throttled(self, wait):
+        """Answer a frame refused by a rate limit with when to retry"""
+        metrics.throttled_frames.inc()
+        if not self.throttled:
+            # Once per burst of refused frames, not for every one
+            self.throttled = True
+            security_logger.warning(f"Rate limited user {self.user.username} in room {self.room_name}")
+        await self.send_frame({
+            'type': 'error',
+            'code': 'rate_limited',
+            'message': 'Rate limit exceeded',
+            'retry_after': retry_after_hint(wait)
+        })
+
+    def max_batch_operations(self):
+        """Operations accepted in one frame.
+
+        With rate limiting on, a batch may not cost more tokens than the room
+        and batch buckets can hold, so batching never exceeds their rates.
+        """
+        max_operations = getattr(settings, 'CHAT_MAX_BATCH_OPERATIONS', 100)
+        if rate_limits_enabled():
+            limit = get_rate_limiter().max_operations
+            if limit is not None:
+                max_operations = min(max_operations, limit)
+        return max_operations
+
+    async def receive_batch(self, operations):
+        """Handle a frame carrying a list of chat operations.
+
+        Valid operations are saved in one transaction and broadcast as a
+        single ``chat_messages`` frame; the sender gets one ``batch_result``
+        frame with a result per operation, in order.
+        """
+        results = []
+        valid = []
+        for index, operation in enumerate(operations):
+            if not isinstance(operation, dict):
+                results.append({'index': index, 'status': 'error', 'message': 'Invalid operation'})
+                continue
+            message, message_type, file_info, error = self.parse_message(operation)
+            if error:
+                results.append({'index': index, 'status': 'error', 'message': error})
+                continue
+            results.append({'index': index, 'status': 'ok'})
+            valid.append((index, message, message_type, file_info))
+
+        message_logger.info("User %s sending batch of %d/%d messages in room %s", self.user.username, len(valid), len(operations), self.room_name)
+
+        if valid:
+            # Create the room on its first message
+            if self.room_id is None:
+                self.room_id = await self.resolve_room_id(create=True)
+                logger.info(f"Created new room: {self.room_name}")
+
+            with tracing.span('save'):
+                chat_messages = await self.save_messages(
+                    [(message, message_type, file_info) for _, message, message_type, file_info in valid]
+                )
+            for (index, _, _, _), chat_message in zip(valid, chat_messages):
+                results[index]['message_id'] = chat_message.id
+
+            with tracing.span('encode'):
+                event = {
+                    'type': 'chat_message',
+                    'message_ids': [chat_message.id for chat_message in chat_messages],
+                    **codecs.encode_broadcast({
+                        'type': 'chat_messages',
+                        'messages': [self.build_message_data(chat_message) for chat_message in chat_messages]
+                    })
+                }
+            await self.group_send(event)
+            message_logger.info("Batch of %d messages broadcasted from user %s", len(chat_messages), self.user.username)
+
+            if thumbnails_enabled():
+                get_thumbnail_pipeline().schedule(self.room_group_name, chat_messages)
+
+        await self.send_frame({
+            'type': 'batch_result',
+            'results': results
+        })
+
+        if valid:
+            with tracing.span('notify'):
+                await self.create_notifications_for_offline_users(chat_messages)
+
+    def parse_message(self, payload):
+        """Extract and validate a chat message.
+
+        Returns ``(message, message_type, file_info, error)`` where ``error``
+        is None for a valid message.
+        """
+        message = payload.get('message') or ''
+        message_type = payload.get('message_type', 'text')
+        file_info = payload.get('file_info', None)
+
+        if not isinstance(message, str) or not isinstance(message_type, str):
+            logger.warning(f"Malformed message fields from user {self.user.username}")
+            return '', message_type, file_info, 'Message and message type must be strings'
+        message = message.strip()
+
+        # Validate based on message type
+        if message_type == 'text':
+            if not message:
+                logger.warning(f"Empty message content from user {self.user.username}")
+                return message, message_type, file_info, 'Message content cannot be empty'
+
+            # Validate message length
+            if len(message) > 1000:
+                logger.warning(f"Message too long from user {self.user.username}: {len(message)} characters")
+                return message, message_type, file_info, 'Message too long (max 1000 characters)'
+        else:
+            if message_type not in FILE_MESSAGE_TYPES:
+                logger.warning(f"Unknown message type from user {self.user.username}")
+                return message, message_type, file_info, 'Invalid message type'
+
+            # File message validation
+            if not isinstance(file_info, dict) or not file_info.get('file_name'):
+                logger.warning(f"Invalid file info from user {self.user.username}")
+                return message, message_type, file_info, 'File information is required for file messages'
+
+            # Copied onto the message as-is, so check them against the columns
+            error = file_info_error(file_info)
+            if error:
+                logger.warning(f"Invalid file info from user {self.user.username}: {error}")
+                return message, message_type, file_info, error
+
+        return message, message_type, file_info, None
+
+    def build_message_data(self, chat_message, username=None):
+        """Build the client-facing representation of a saved message"""
+        return build_message_data(chat_message, username or self.user.username)
 
     async def chat_message(self, event):
-        """Handle chat messages"""
+        """Handle chat messages.
+
+        The event carries the already-encoded JSON frame in ``text``, so
+        fanning out to a large room costs one ``send`` per socket and no
+        re-serialization; MessagePack sockets share one conversion per process
+        (see ``codecs.broadcast_frame``).
+        """
         try:
-            message = event['message']
-            username = event['username']
-            timestamp = event['timestamp']
-            message_id = event.get('message_id')
-            message_type = event.get('message_type', 'text')
-            
-            logger.info(f"Broadcasting message to user {self.user.username} in room {self.room_name}: {message[:50]}...")
-            
-            # Validate event data
-            if not all([message, username, timestamp]):
-                logger.warning(f"Incomplete message event data: {event}")
-                return
-            
-            # Build response data
-            response_data = {
-                'type': 'chat_message',
-                'message': message,
-                'username': username,
-                'timestamp': timestamp,
-                'message_id': message_id,
-                'message_type': message_type
-            }
-            
-            # Add file information if it's a file message
-            if message_type != 'text':
-                response_data['file_name'] = event.get('file_name')
-                response_data['file_size'] = event.get('file_size')
-                response_data['mime_type'] = event.get('mime_type')
-            
-            # Send message to WebSocket
-            await self.send(text_data=json.dumps(response_data))
-            
-            # Create notifications for offline users in the room
-            if self.user.username != username:  # Don't notify self
-                await self.create_notifications_for_offline_users(message, username, message_id)
-            
-            logger.info(f"Message successfully sent to user {self.user.username}")
-            
+            with metrics.chat_message_seconds.time(), \
+                    tracing.trace('chat_message', event.get('trace'), sample=False, room=self.room_name):
+                with tracing.span('encode'):
+                    text_data, bytes_data = codecs.broadcast_frame(event, self.encoding)
+                with tracing.span('send'):
+                    await self.send(text_data=text_data, bytes_data=bytes_data)
+                with tracing.span('history'):
+                    recent_history.record(self.room_name, event)
         except KeyError as e:
             logger.error(f"Missing required field in chat_message event: {str(e)}")
             logger.error(f"Event data: {event}")
@@ -336,75 +556,107 @@ class ChatConsumer(AsyncWebsocketConsumer):
             logger.error(f"Error sending chat message to user {self.user.username}: {str(e)}")
             logger.error(traceback.format_exc())
 
-    async def create_notifications_for_offline_users(self, message_content, sender_username, message_id):
-        """Create notifications for offline users in the room"""
+    async def chat_thumbnails(self, event):
+        """Forward thumbnails rendered for a message after it was broadcast"""
         try:
-            # Get all users in the room except the sender
-            room_users = await self.get_room_users()
-            for user in room_users:
-                if user.username != sender_username:
-                    # Check if user is offline
-                    is_online = await self.check_user_online(user.id)
-                    if not is_online:
-                        await self.create_notification(
-                            recipient_id=user.id,
-                            notification_type='message',
-                            title=f'New message from {sender_username}',
-                            message=message_content,
-                            related_message_id=message_id,
-                            room_name=self.room_name
-                        )
+            text_data, bytes_data = codecs.broadcast_frame(event, self.encoding)
+            await self.send(text_data=text_data, bytes_data=bytes_data)
+            recent_history.update(self.room_name, event['message_id'], {'thumbnails': event['thumbnails']})
         except Exception as e:
-            logger.error(f'Error creating notifications for offline users: {str(e)}')
+            logger.error(f"Error sending thumbnails to user {self.user.username}: {str(e)}")
 
-    @database_sync_to_async
-    def get_room_users(self):
-        """Get all users in the current room"""
-        room = ChatRoom.objects.get(name=self.room_name)
-        user_ids = UserRoom.objects.filter(room=room).values_list('user_id', flat=True)
-        return User.objects.filter(id__in=user_ids)
+    async def history_invalidate(self, event):
+        """Drop the room's buffer after messages were deleted or archived"""
+        recent_history.evict(self.room_name)
 
-    @database_sync_to_async
-    def check_user_online(self, user_id):
-        """Check if user is online"""
+    async def notification_counts(self, event):
+        """Push updated unread notification counts to this socket"""
         try:
-            presence = UserPresence.objects.get(user_id=user_id)
-            return presence.is_online
-        except UserPresence.DoesNotExist:
-            return False
+            await self.send_frame({
+                'type': 'notification_counts',
+                **event['counts']
+            })
+        except Exception as e:
+            logger.error(f"Error sending notification counts to user {self.user.username}: {str(e)}")
 
-    @database_sync_to_async
-    def get_user(self, user_id):
+    async def send_recent_history(self):
+        """Send the most recent messages of the room right after connecting"""
         try:
-            logger.info("Attempting to validate JWT token")
-            
-            # Validate user_id format
-            if not user_id:
-                logger.warning("No user_id provided")
-                return AnonymousUser()
-            
-            user = User.objects.get(id=user_id)
-            logger.info(f"Successfully authenticated user: {user.username} (ID: {user.id})")
-            return user
-            
-        except User.DoesNotExist:
-            logger.warning(f"User with ID {user_id} does not exist")
-            return AnonymousUser()
+            messages = recent_history.get(self.room_name)
+            if messages is None:
+                # First connection to this room in this process; hold what is
+                # broadcast while the query runs
+                token = recent_history.begin_load(self.room_name)
+                chat_messages = await self.load_recent_messages(recent_history.size)
+                messages = [
+                    self.build_message_data(chat_message, username=chat_message.user.username)
+                    for chat_message in chat_messages
+                ]
+                recent_history.load(self.room_name, messages, token)
+            await self.send_frame({
+                'type': 'history',
+                'messages': messages
+            })
         except Exception as e:
-            logger.warning(f"Token validation failed: {str(e)}")
-            return AnonymousUser()
+            logger.error(f"Error sending recent history in room {self.room_name}: {str(e)}")
 
-    def get_current_timestamp(self):
+    @database_sync_to_async
+    def load_recent_messages(self, limit):
+        """Load the newest messages of the room, oldest first"""
+        if self.room_id is None:
+            return []
+        chat_messages = list(
+            ChatMessage.objects.filter(room_id=self.room_id)
+            .select_related('user')
+            .defer('search_vector')
+            .order_by('-timestamp', '-id')[:limit]
+        )
+        chat_messages.reverse()
+        return chat_messages
+
+    async def create_notifications_for_offline_users(self, chat_messages):
+        """Create notifications for offline users in the room.
+
+        Runs once per saved message (or batch) on the sender's side, so the
+        cost does not grow with the number of connected recipients.
+        """
         try:
-            from datetime import datetime, timezone
-            
-            # Use timezone-aware datetime with built-in timezone support
-            timestamp = datetime.now(timezone.utc).isoformat()
-            logger.debug(f"Generated timestamp: {timestamp}")
-            return timestamp
-            
+            created = await self.save_offline_notifications(chat_messages)
+            message_logger.info("Created %d offline notifications for %d messages", created, len(chat_messages))
         except Exception as e:
-            logger.error(f"Error generating timestamp: {str(e)}")
-            # Fallback to simple datetime
-            from datetime import datetime
-            return datetime.now().isoformat()
\ No newline at end of file
+            logger.error(f'Error creating notifications for offline users: {str(e)}')
+
+    @database_sync_to_async
+    def save_offline_notifications(self, chat_messages):
+        """Bulk insert notifications for room members who are not online"""
+        member_ids = set(UserRoom.objects.filter(
+            room_id=self.room_id
+        ).exclude(
+            user_id=self.user.id
+        ).values_list('user_id', flat=True))
+        # The presence store is authoritative; UserPresence rows lag behind it
+        offline_user_ids = member_ids - get_presence_tracker().filter_online(member_ids)
+
+        notifications = []
+        for chat_message in chat_messages:
+            if chat_message.message_type == 'text':
+                content = chat_message.message
+            else:
+                content = f'[{chat_message.message_type}] {chat_message.file_name or "file"}'
+
+            notifications.extend(
+                Notification(
+                    recipient_id=user_id,
+                    sender_id=self.user.id,
+                    notification_type='message',
+                    title=f'New message from {self.user.username}',
+                    message=content,
+                    related_message_id=chat_message.id,
+                    room_name=self.room_name
+                )
+                for user_id in offline_user_ids
+            )
+        with transaction.atomic():
+            Notification.objects.bulk_create(notifications)
+            NotificationCounter.increment(notifications)
+        return len(notifications)
@@ -0,0 +1,208 @@
+import json
+import logging
+import threading
+from collections import Counter, OrderedDict, deque
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import ChatMessage, ChatRoom
+
+logger = logging.getLogger('chat.websocket')
+
+
+class RecentHistory:
+    """Per-room ring buffers of the most recent message frames.
+
+    Buffers hold the client-facing message dicts so a new connection can be
+    sent the last screen of messages without a database query. At most
+    ``max_rooms`` buffers are kept; the least recently used room is evicted and
+    reloaded from the database on its next connection.
+
+    A buffer is only kept while the process has a connection in the room, since
+    those connections are what feed it broadcasts; the last one to leave drops
+    it. Messages broadcast while a buffer is being loaded from the database are
+    held aside and merged into it.
+    """
+
+    def __init__(self, size=50, max_rooms=1000):
+        self.size = size
+        self.max_rooms = max_rooms
+        self._rooms = OrderedDict()  # room name -> (deque of messages, set of message ids)
+        self._pending = {}  # room name -> {message id: message} broadcast during a load
+        self._connections = Counter()  # room name -> local connections
+        self._lock = threading.Lock()
+
+    def attach(self, room_name):
+        """Count a local connection that receives the room's broadcasts"""
+        with self._lock:
+            self._connections[room_name] += 1
+
+    def detach(self, room_name):
+        """Uncount a connection; the last one to leave drops the room's buffer"""
+        with self._lock:
+            self._connections[room_name] -= 1
+            if self._connections[room_name] <= 0:
+                del self._connections[room_name]
+                self._rooms.pop(room_name, None)
+                self._pending.pop(room_name, None)
+
+    def get(self, room_name):
+        """Return the buffered messages for a room, or None if it is not loaded"""
+        with self._lock:
+            entry = self._rooms.get(room_name)
+            if entry is None:
+                return None
+            self._rooms.move_to_end(room_name)
+            return list(entry[0])
+
+    def begin_load(self, room_name):
+        """Start holding broadcasts for a room about to be loaded from the database.
+
+        Returns a token for ``load``; call it before querying so nothing
+        broadcast while the query runs is missed.
+        """
+        with self._lock:
+            return self._pending.setdefault(room_name, {})
+
+    def load(self, room_name, messages, token):
+        """Install a buffer loaded from the database.
+
+        Messages broadcast since ``begin_load`` are appended. Nothing is
+        installed if a buffer appeared meanwhile, or if the room was evicted or
+        its last connection left since ``begin_load``.
+        """
+        with self._lock:
+            if room_name in self._rooms or self._pending.get(room_name) is not token:
+                return
+            del self._pending[room_name]
+            if room_name not in self._connections:
+                return
+            loaded = {message['message_id'] for message in messages}
+            messages = messages + [message for message_id, message in token.items() if message_id not in loaded]
+            buffer = deque(messages[-self.size:], maxlen=self.size)
+            self._rooms[room_name] = (buffer, {message['message_id'] for message in buffer})
+            while len(self._rooms) > self.max_rooms:
+                self._rooms.popitem(last=False)
+
+    def record(self, room_name, event):
+        """Append the messages of a broadcast event to a loaded buffer.
+
+        Every consumer in the process sees the same event, so messages already
+        buffered are skipped and the frame is decoded at most once per process.
+        """
+        with self._lock:
+            entry = self._rooms.get(room_name)
+            if entry is None:
+                pending = self._pending.get(room_name)
+                if pending is not None:
+                    for message in self._decode(event, pending):
+                        pending[message['message_id']] = message
+                return
+            buffer, seen = entry
+            for message in self._decode(event, seen):
+                if len(buffer) == buffer.maxlen:
+                    seen.discard(buffer[0]['message_id'])
+                buffer.append(message)
+                seen.add(message['message_id'])
+
+    @staticmethod
+    def _decode(event, seen):
+        """The messages of a broadcast event whose ids are not in ``seen``"""
+        message_ids = event.get('message_ids', [])
+        if not message_ids or all(message_id in seen for message_id in message_ids):
+            return []
+        data = json.loads(event['text'])
+        messages = data['messages'] if data.get('type') == 'chat_messages' else [data]
+        return [message for message in messages if message['message_id'] not in seen]
+
+    def update(self, room_name, message_id, fields):
+        """Merge ``fields`` into a buffered message, if it is still buffered"""
+        with self._lock:
+            entry = self._rooms.get(room_name)
+            if entry is None:
+                pending = self._pending.get(room_name)
+                if pending is not None and message_id in pending:
+                    pending[message_id].update(fields)
+                return
+            if message_id not in entry[1]:
+                return
+            for message in entry[0]:
+                if message['message_id'] == message_id:
+                    message.update(fields)
+                    return
+
+    def evict(self, room_name):
+        """Drop a room's buffer, and any load in progress, so it is reloaded"""
+        with self._lock:
+            self._rooms.pop(room_name, None)
+            self._pending.pop(room_name, None)
+
+
+recent_history = RecentHistory(
+    size=getattr(settings, 'CHAT_HISTORY_SIZE', 50),
+    max_rooms=getattr(settings, 'CHAT_HISTORY_MAX_ROOMS', 1000)
+)
+
+
+# Rooms whose buffers are dropped when this thread's transaction commits
+_pending_invalidations = threading.local()
+
+
+def _pending():
+    if not hasattr(_pending_invalidations, 'names'):
+        _pending_invalidations.names = set()
+        _pending_invalidations.room_ids = set()
+    return _pending_invalidations
+
+
+def invalidate_room(room_name):
+    """Drop a room's buffers in every process once the current transaction commits.
+
+    Processes with a buffer for the room have a connection in its group, so
+    the group event reaches each of them.
+    """
+    _pending().names.add(room_name)
+    transaction.on_commit(_flush_invalidations)
+
+
+def _flush_invalidations():
+    """Invalidate every pending room once.
+
+    Each deleted row registers this callback, but the first run takes all
+    pending rooms, so a bulk delete costs one room lookup and one group
+    event per room rather than per message. Rooms left over from a rolled
+    back transaction are invalidated with the next commit, which is harmless.
+    """
+    pending = _pending()
+    names, room_ids = pending.names, pending.room_ids
+    if not names and not room_ids:
+        return
+    pending.names, pending.room_ids = set(), set()
+    if room_ids:
+        names.update(ChatRoom.objects.filter(id__in=room_ids).values_list('name', flat=True))
+    channel_layer = get_channel_layer()
+    for room_name in names:
+        recent_history.evict(room_name)
+        try:
+            async_to_sync(channel_layer.group_send)(f'chat_{room_name}', {'type': 'history_invalidate'})
+        except Exception as e:
+            logger.error(f'Error invalidating recent history of room {room_name}: {str(e)}')
+
+
+@receiver(post_delete, sender=ChatMessage)
+def invalidate_deleted_message(sender, instance, origin=None, **kwargs):
+    # A deleted room invalidates its history once, not per message
+    if isinstance(origin, ChatRoom) or getattr(origin, 'model', None) is ChatRoom:
+        return
+    _pending().room_ids.add(instance.room_id)
+    transaction.on_commit(_flush_invalidations)
+
+
+@receiver(post_delete, sender=ChatRoom)
+def invalidate_deleted_room(sender, instance, **kwargs):
+    invalidate_room(instance.name)
@@ -0,0 +1,76 @@
+"""Thumbnail rendering run in worker processes.
+
+Functions here take plain filesystem paths and must not touch Django, so they
+can be pickled into a ``ProcessPoolExecutor`` started with ``spawn``.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+THUMBNAIL_QUALITY = 80
+
+
+def available():
+    """Whether thumbnails can be rendered in this environment"""
+    return Image is not None
+
+
+def extract_poster(video_path, output_path):
+    """Write a representative frame of a video to ``output_path``.
+
+    Requires ffmpeg on the PATH; returns False when no frame could be taken.
+    """
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        return False
+    result = subprocess.run(
+        [ffmpeg, '-v', 'error', '-y', '-i', video_path, '-vf', 'thumbnail', '-frames:v', '1', output_path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        timeout=60
+    )
+    return result.returncode == 0 and os.path.exists(output_path)
+
+
+def render_thumbnails(source_path, targets, poster=False):
+    """Render JPEG thumbnails of an image, or of a video's poster frame.
+
+    ``targets`` is a list of ``(size, output_path)`` pairs; each thumbnail fits
+    in a ``size`` x ``size`` box. Sizes not smaller than the source are skipped
+    since the original serves them as well. Existing outputs are reused, which
+    makes rendering shared attachments cheap. Returns the sizes available.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        if poster:
+            frame_path = os.path.join(work_dir, 'poster.jpg')
+            if not extract_poster(source_path, frame_path):
+                return []
+            source_path = frame_path
+
+        with Image.open(source_path) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'L'):
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                image = image.convert('RGBA')
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+
+            rendered = []
+            for size, output_path in sorted(targets):
+                if size >= max(image.size) and not poster:
+                    continue
+                if not os.path.exists(output_path):
+                    thumbnail = image.copy()
+                    thumbnail.thumbnail((size, size), Image.LANCZOS)
+                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                    partial_path = f'{output_path}.{os.getpid()}.tmp'
+                    thumbnail.save(partial_path, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+                    os.replace(partial_path, output_path)
+                rendered.append(size)
+            return rendered
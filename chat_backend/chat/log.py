@@ -0,0 +1,108 @@
+"""Non-blocking logging for the chat server.
+
+``configure_logging`` is used as ``LOGGING_CONFIG``: it applies the
+``LOGGING`` dict as usual and then moves the handlers of every configured
+logger behind a queue. Consumers and views only enqueue records; a single
+listener thread formats them and does the file, console and mail I/O.
+"""
+import atexit
+import logging
+import logging.config
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+_listener = None
+
+
+class SamplingFilter(logging.Filter):
+    """Pass a random ``rate`` fraction of records at or below ``max_level``.
+
+    Meant for per-message log lines: attach it to the logger they are written
+    to. Records above ``max_level`` (warnings and errors by default) always
+    pass.
+    """
+
+    def __init__(self, rate=1.0, max_level='INFO', name=''):
+        super().__init__(name)
+        self.rate = float(rate)
+        self.max_level = logging.getLevelName(max_level) if isinstance(max_level, str) else max_level
+
+    def filter(self, record):
+        if record.levelno > self.max_level or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+class QueueDispatchHandler(QueueHandler):
+    """Enqueue records for the listener thread, tagged with their real handlers.
+
+    When the queue is full records are dropped and counted rather than
+    blocking the caller.
+    """
+
+    def __init__(self, log_queue, handlers):
+        super().__init__(log_queue)
+        self.target_handlers = handlers
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        record.target_handlers = self.target_handlers
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class QueueDispatchListener(QueueListener):
+    """Listener passing each record to the handlers it was tagged with"""
+
+    def handle(self, record):
+        for handler in record.target_handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+def queue_loggers(loggers, maxsize=10000):
+    """Move the handlers of ``loggers`` behind one queue and listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    log_queue = queue.Queue(maxsize)
+    for logger in loggers:
+        handlers = [handler for handler in logger.handlers if not isinstance(handler, QueueDispatchHandler)]
+        if not handlers:
+            continue
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.addHandler(QueueDispatchHandler(log_queue, handlers))
+
+    _listener = QueueDispatchListener(log_queue)
+    _listener.start()
+
+
+def stop_listener():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def configure_logging(logging_settings):
+    """``LOGGING_CONFIG`` entry point"""
+    from django.conf import settings
+
+    logging.config.dictConfig(logging_settings)
+    loggers = [logging.getLogger(name) for name in logging_settings.get('loggers', {})]
+    if 'root' in logging_settings:
+        loggers.append(logging.getLogger())
+    queue_loggers(loggers, maxsize=getattr(settings, 'CHAT_LOG_QUEUE_SIZE', 10000))
+
+
+atexit.register(stop_listener)
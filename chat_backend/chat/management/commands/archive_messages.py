@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.archive import archivable_messages, archivable_months, archive_room_month
+
+
+class Command(BaseCommand):
+    help = 'Move messages older than the retention window into compressed per-room, per-month segment files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=getattr(settings, 'CHAT_ARCHIVE_AFTER_DAYS', 180),
+            help='Archive messages older than this many days (default: CHAT_ARCHIVE_AFTER_DAYS)'
+        )
+        parser.add_argument('--room', type=int, help='Only archive the room with this id')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be archived without changing anything')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        months = archivable_months(cutoff, room_id=options['room'])
+
+        archived = 0
+        for room_id, month in months:
+            # One bounded query per segment, so rows are never deleted under an open cursor
+            messages = list(archivable_messages(cutoff, room_id=room_id, month=month))
+            if not options['dry_run']:
+                archive_room_month(room_id, month, messages)
+            self.stdout.write(f'Room {room_id} {month:%Y-%m}: {len(messages)} messages')
+            archived += len(messages)
+
+        verb = 'Would archive' if options['dry_run'] else 'Archived'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {archived} messages into {len(months)} segments'))
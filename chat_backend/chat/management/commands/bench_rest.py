@@ -0,0 +1,156 @@
+import random
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat.benchmarking import QueryCounter, latency_summary, percentile, write_results
+from chat.models import ChatMessage, ChatRoom, Notification
+from chat.pagination import HistoryPagination
+from chat.presence import get_presence_tracker
+from chat.seeding import DEFAULT_PREFIX, TIERS
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the hot REST endpoints (room list, room history, notifications, online users) '
+        'against seeded datasets and write latency percentiles and query counts as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tiers', nargs='+', choices=TIERS,
+            help='Seed and benchmark each of these size tiers in turn; '
+                 'without it the dataset already in the database is benchmarked'
+        )
+        parser.add_argument('--requests', type=int, default=200, help='Timed requests per endpoint (default: 200)')
+        parser.add_argument('--warmup', type=int, default=20, help='Untimed requests per endpoint first (default: 20)')
+        parser.add_argument('--online', type=float, default=0.1, help='Fraction of users marked online (default: 0.1)')
+        parser.add_argument('--prefix', default=DEFAULT_PREFIX, help=f'Name prefix of seeded users and rooms (default: {DEFAULT_PREFIX})')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+        parser.add_argument('--output', default='rest_benchmark.json', help='Result file (default: rest_benchmark.json)')
+        parser.add_argument('--keep-data', action='store_true', help='Keep the last seeded tier instead of deleting it')
+
+    def handle(self, *args, **options):
+        if settings.DEBUG:
+            self.stderr.write('DEBUG is on: every query is also recorded in connection.queries, inflating timings')
+
+        results = []
+        tiers = options['tiers'] or [None]
+        try:
+            for tier in tiers:
+                if tier is not None:
+                    self.stdout.write(f'Seeding the {tier} tier...')
+                    call_command(
+                        'seed_benchmark_data', tier=tier, prefix=options['prefix'], seed=options['seed'],
+                        clear=True, stdout=self.stdout
+                    )
+                results.extend(self.run_tier(tier or 'existing', options))
+        finally:
+            if options['tiers'] and not options['keep_data']:
+                call_command('seed_benchmark_data', prefix=options['prefix'], clear_only=True, stdout=self.stdout)
+
+        write_results(options['output'], 'rest', {
+            'tiers': options['tiers'],
+            'requests': options['requests'],
+            'warmup': options['warmup'],
+            'online': options['online'],
+            'debug': settings.DEBUG,
+        }, results)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(results)} results to {options['output']}"))
+
+    def run_tier(self, tier, options):
+        rng = random.Random(options['seed'])
+        prefix = options['prefix']
+
+        users = list(User.objects.filter(username__startswith=prefix).values_list('id', flat=True))
+        rooms = list(ChatRoom.objects.filter(name__startswith=prefix).values_list('id', flat=True))
+        if not users or not rooms:
+            raise CommandError(f'No seeded users and rooms with prefix {prefix!r}; run seed_benchmark_data first')
+
+        dataset = {
+            'users': User.objects.count(),
+            'rooms': ChatRoom.objects.count(),
+            'messages': ChatMessage.objects.count(),
+            'notifications': Notification.objects.count(),
+        }
+        tokens = {}
+
+        def token_for(user_id):
+            if user_id not in tokens:
+                tokens[user_id] = str(AccessToken.for_user(User(id=user_id)))
+            return tokens[user_id]
+
+        pagination = HistoryPagination()
+
+        def deep_history_url():
+            # A cursor at a random point of a random room's history
+            room_id = rng.choice(rooms)
+            count = ChatMessage.objects.filter(room_id=room_id).count()
+            url = reverse('chat:room-messages', args=[room_id])
+            if not count:
+                return url
+            position = ChatMessage.objects.filter(room_id=room_id).order_by('timestamp', 'id').only(
+                'id', 'timestamp'
+            )[rng.randrange(count)]
+            return f'{url}?before={pagination.encode_cursor(position)}'
+
+        endpoints = {
+            'room_list': lambda: reverse('chat:room-list-create'),
+            'room_messages': lambda: reverse('chat:room-messages', args=[rng.choice(rooms)]),
+            'room_messages_deep': deep_history_url,
+            'notifications': lambda: reverse('chat:get-notifications'),
+            'notifications_unread': lambda: reverse('chat:get-notifications') + '?is_read=false',
+            'online_users': lambda: reverse('chat:get-online-users'),
+        }
+
+        backend = get_presence_tracker().backend
+        online = rng.sample(users, int(len(users) * options['online']))
+        for user_id in online:
+            backend.connect(user_id, f'bench.{user_id}', None, time.time() + 3600)
+
+        host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+        client = Client(HTTP_HOST=host)
+        counter = QueryCounter()
+        counter.install()
+        results = []
+        try:
+            for name, make_url in endpoints.items():
+                latencies, queries, statuses = [], [], Counter()
+                for index in range(options['warmup'] + options['requests']):
+                    url = make_url()
+                    user_id = rng.choice(users)
+                    counter.reset()
+                    started = time.perf_counter()
+                    response = client.get(url, HTTP_AUTHORIZATION=f'Bearer {token_for(user_id)}')
+                    elapsed = time.perf_counter() - started
+                    if index < options['warmup']:
+                        continue
+                    latencies.append(elapsed)
+                    queries.append(counter.reset())
+                    statuses[response.status_code] += 1
+
+                result = {
+                    'tier': tier,
+                    'dataset': dataset,
+                    'endpoint': name,
+                    'latency': latency_summary(latencies),
+                    'queries': {'p50': percentile(queries, 0.50), 'max': max(queries, default=None)},
+                    'status_codes': {str(code): count for code, count in sorted(statuses.items())},
+                }
+                results.append(result)
+                self.stdout.write(
+                    f"  {tier} {name}: p50 {result['latency']['p50_ms']} ms, p99 {result['latency']['p99_ms']} ms, "
+                    f"{result['queries']['p50']} queries"
+                )
+        finally:
+            counter.uninstall()
+            for user_id in online:
+                backend.disconnect(user_id, f'bench.{user_id}')
+        return results
@@ -0,0 +1,303 @@
+import asyncio
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat.benchmarking import QueryCounter, latency_summary, rss_bytes, write_results
+from chat.models import ChatRoom, UserRoom
+
+USER_PREFIX = 'bench_ws_user_'
+ROOM_PREFIX = 'bench_ws_room_'
+STOP_MESSAGE = 'bench-stop'
+
+# Runs daphne with WebSocket rate limits off, whatever the settings module;
+# the benchmark sends far faster than one client is allowed to
+SERVER_BOOTSTRAP = (
+    'import django; from django.conf import settings; django.setup(); '
+    'settings.CHAT_RATE_LIMIT_ENABLED = False; '
+    'from daphne.cli import CommandLineInterface; CommandLineInterface.entrypoint()'
+)
+
+
+class CommunicatorClient:
+    """In-process client driving the ASGI application directly"""
+
+    def __init__(self, application):
+        self.application = application
+        self.communicator = None
+
+    async def connect(self, path, token):
+        from channels.testing import WebsocketCommunicator
+
+        self.communicator = WebsocketCommunicator(
+            self.application, path, headers=[(b'authorization', f'Bearer {token}'.encode())]
+        )
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise CommandError(f'Connection to {path} was rejected')
+
+    async def send(self, data):
+        await self.communicator.send_to(text_data=json.dumps(data))
+
+    async def receive(self, timeout):
+        return json.loads(await self.communicator.receive_from(timeout=timeout))
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class LiveClient:
+    """Client connecting to a running server over a real socket"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.socket = None
+
+    async def connect(self, path, token):
+        try:
+            import websockets
+        except ImportError:
+            raise CommandError('Benchmarking a live server requires the websockets package')
+        self.socket = await websockets.connect(
+            self.base_url + path, subprotocols=['bearer', token], max_queue=None
+        )
+
+    async def send(self, data):
+        await self.socket.send(json.dumps(data))
+
+    async def receive(self, timeout):
+        return json.loads(await asyncio.wait_for(self.socket.recv(), timeout))
+
+    async def close(self):
+        await self.socket.close()
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark ChatConsumer fanout over a sweep of rooms x members x send rate, '
+        'in-process or against a live server, and write the results as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, nargs='+', default=[1, 10], help='Room counts to sweep')
+        parser.add_argument('--members', type=int, nargs='+', default=[2, 10], help='Connections per room to sweep')
+        parser.add_argument('--rates', type=float, nargs='+', default=[5, 20], help='Messages per second per room to sweep')
+        parser.add_argument('--duration', type=float, default=5, help='Seconds of sending per sweep point (default: 5)')
+        parser.add_argument('--output', default='websocket_benchmark.json', help='Result file (default: websocket_benchmark.json)')
+        target = parser.add_mutually_exclusive_group()
+        target.add_argument('--server', action='store_true', help='Launch a local daphne server and benchmark it over real sockets')
+        target.add_argument(
+            '--url',
+            help='Benchmark an already running server, e.g. ws://127.0.0.1:8000; it must run with CHAT_RATE_LIMIT_ENABLED off'
+        )
+        parser.add_argument('--port', type=int, default=8765, help='Port for --server (default: 8765)')
+        parser.add_argument('--keep-data', action='store_true', help='Keep the benchmark users, rooms and messages')
+
+    def handle(self, *args, **options):
+        points = list(itertools.product(options['rooms'], options['members'], options['rates']))
+        max_rooms = max(options['rooms'])
+        max_connections = max(options['rooms']) * max(options['members'])
+        tokens, room_names = self.create_fixtures(max_rooms, max(options['members']), max_connections)
+
+        server = None
+        if options['server']:
+            server = self.start_server(options['port'])
+            mode, base_url = 'server', f"ws://127.0.0.1:{options['port']}"
+        elif options['url']:
+            mode, base_url = 'url', options['url']
+        else:
+            mode, base_url = 'in-process', None
+
+        counter = QueryCounter() if mode == 'in-process' else None
+        if counter is not None:
+            counter.install()
+
+        # Rate limits would refuse most of the load being measured
+        rate_limits = override_settings(CHAT_RATE_LIMIT_ENABLED=False)
+        rate_limits.enable()
+        results = []
+        try:
+            for rooms, members, rate in points:
+                self.stdout.write(f'{rooms} rooms x {members} members at {rate} msg/s per room...')
+                result = asyncio.run(self.run_point(
+                    mode, base_url, server, counter, tokens, room_names[:rooms], members, rate, options['duration']
+                ))
+                results.append(result)
+                self.stdout.write(
+                    f"  p50 {result['latency']['p50_ms']} ms, p99 {result['latency']['p99_ms']} ms, "
+                    f"{result['deliveries_per_second']} deliveries/s"
+                )
+        finally:
+            rate_limits.disable()
+            if counter is not None:
+                counter.uninstall()
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=10)
+            if not options['keep_data']:
+                self.delete_fixtures()
+
+        write_results(options['output'], 'websocket', {
+            'mode': mode,
+            'url': base_url,
+            'rooms': options['rooms'],
+            'members': options['members'],
+            'rates': options['rates'],
+            'duration': options['duration'],
+        }, results)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(results)} results to {options['output']}"))
+
+    def create_fixtures(self, room_count, members, user_count):
+        users = []
+        for index in range(user_count):
+            user, _ = User.objects.get_or_create(username=f'{USER_PREFIX}{index}')
+            users.append(user)
+        room_names = []
+        for index in range(room_count):
+            room, _ = ChatRoom.objects.get_or_create(name=f'{ROOM_PREFIX}{index}')
+            room_names.append(room.name)
+            UserRoom.objects.bulk_create(
+                [UserRoom(user=user, room=room) for user in users[index * members:(index + 1) * members]],
+                ignore_conflicts=True
+            )
+        return [str(AccessToken.for_user(user)) for user in users], room_names
+
+    def delete_fixtures(self):
+        ChatRoom.objects.filter(name__startswith=ROOM_PREFIX).delete()
+        User.objects.filter(username__startswith=USER_PREFIX).delete()
+
+    def start_server(self, port):
+        env = dict(os.environ)
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'chat_backend.settings')
+        server = subprocess.Popen(
+            [sys.executable, '-c', SERVER_BOOTSTRAP, '-b', '127.0.0.1', '-p', str(port), 'chat_backend.asgi:application'],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError('daphne exited before accepting connections')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError(f'daphne did not start listening on port {port}')
+
+    def make_client(self, mode, base_url):
+        if mode == 'in-process':
+            from chat_backend.asgi import application
+            return CommunicatorClient(application)
+        return LiveClient(base_url)
+
+    async def run_point(self, mode, base_url, server, counter, tokens, room_names, members, rate, duration):
+        timeout = duration + 60
+        rss_before = rss_bytes(server.pid if server else None) if mode != 'url' else None
+
+        rooms = []
+        for room_index, room_name in enumerate(room_names):
+            clients = []
+            for member in range(members):
+                client = self.make_client(mode, base_url)
+                await client.connect(f'/ws/chat/{room_name}/', tokens[room_index * members + member])
+                # Connection frame, then the recent history
+                await client.receive(timeout)
+                await client.receive(timeout)
+                clients.append(client)
+            rooms.append((room_name, clients))
+
+        connections = len(room_names) * members
+        rss_after = rss_bytes(server.pid if server else None) if mode != 'url' else None
+
+        latencies = []
+        deliveries = [0]
+        errors = []
+        failed = asyncio.Event()
+
+        async def read(client):
+            while True:
+                frame = await client.receive(timeout)
+                if frame.get('type') == 'error':
+                    # A refused send never shows up as a delivery; stop waiting
+                    errors.append(frame.get('code') or frame.get('message'))
+                    failed.set()
+                    continue
+                messages = frame.get('messages', []) if frame.get('type') == 'chat_messages' else [frame]
+                for message in messages:
+                    if message.get('type') != 'chat_message':
+                        continue
+                    text = message.get('message') or ''
+                    if text == STOP_MESSAGE:
+                        return
+                    if text.startswith('bench '):
+                        latencies.append(time.perf_counter() - float(text.rsplit(' ', 1)[1]))
+                        deliveries[0] += 1
+
+        async def send(client, room_name):
+            sent = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < duration:
+                await client.send({'message': f'bench {room_name} {sent} {time.perf_counter()!r}'})
+                sent += 1
+                delay = start + sent / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await client.send({'message': STOP_MESSAGE})
+            return sent
+
+        if counter is not None:
+            counter.reset()
+        readers = [asyncio.ensure_future(read(client)) for _, clients in rooms for client in clients]
+        started = time.perf_counter()
+        sent = sum(await asyncio.gather(*(send(clients[0], room_name) for room_name, clients in rooms)))
+        reading = asyncio.ensure_future(asyncio.gather(*readers))
+        failing = asyncio.ensure_future(failed.wait())
+        await asyncio.wait([reading, failing], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        elapsed = time.perf_counter() - started
+        queries = counter.reset() if counter is not None else None
+        failing.cancel()
+        if not reading.done():
+            reading.cancel()
+        elif reading.exception() is not None:
+            raise reading.exception()
+
+        for _, clients in rooms:
+            for client in clients:
+                await client.close()
+
+        # Latency and per-message figures over a partial run would mislead
+        if errors or deliveries[0] != sent * members:
+            error_summary = f", {len(errors)} error frames (first: {errors[0]})" if errors else ''
+            raise CommandError(
+                f'Incomplete run at {len(room_names)} rooms x {members} members, {rate} msg/s: '
+                f'{deliveries[0]} of {sent * members} deliveries{error_summary}'
+            )
+
+        return {
+            'rooms': len(room_names),
+            'members': members,
+            'rate': rate,
+            'connections': connections,
+            'messages_sent': sent,
+            'deliveries': deliveries[0],
+            'expected_deliveries': sent * members,
+            'elapsed_seconds': round(elapsed, 3),
+            'latency': latency_summary(latencies),
+            'messages_per_second': round(sent / elapsed, 1),
+            'deliveries_per_second': round(deliveries[0] / elapsed, 1),
+            # The stop messages are saved too, one per room
+            'queries_per_message': round(queries / (sent + len(room_names)), 2) if queries is not None else None,
+            'rss_per_connection_bytes': (
+                (rss_after - rss_before) // connections if rss_before is not None and rss_after is not None else None
+            ),
+        }
@@ -0,0 +1,56 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.models import ChunkedUpload
+from chat.storage import collect_unused_attachments
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete expired resumable uploads, stray partial files under MEDIA_ROOT/chat_uploads '
+        'and attachments no message has referenced within the grace period'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be deleted without changing anything')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+
+        expired = ChunkedUpload.objects.filter(expires_at__lte=timezone.now())
+        upload_count = expired.count()
+        if not dry_run:
+            # Each row's partial file is removed by its post_delete handler
+            expired.delete()
+
+        # Partial files with no upload row left behind by interrupted requests;
+        # recent ones may belong to an upload still in flight
+        upload_dir = os.path.join(settings.MEDIA_ROOT, 'chat_uploads')
+        cutoff = time.time() - getattr(settings, 'CHAT_RESUMABLE_UPLOAD_EXPIRY', 24 * 60 * 60)
+        live = {f'{upload_id}.part' for upload_id in ChunkedUpload.objects.values_list('id', flat=True)}
+        stray = []
+        if os.path.isdir(upload_dir):
+            with os.scandir(upload_dir) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name not in live and entry.stat().st_mtime < cutoff:
+                        stray.append(entry.path)
+        if not dry_run:
+            for path in stray:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+        attachment_count = collect_unused_attachments(
+            getattr(settings, 'CHAT_ATTACHMENT_GRACE_PERIOD', 24 * 60 * 60), dry_run=dry_run
+        )
+
+        verb = 'Would delete' if dry_run else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {upload_count} expired uploads, {len(stray)} stray partial files '
+            f'and {attachment_count} unused attachments'
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from chat.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text message search index from the messages table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Messages updated per statement on Postgres (default: 5000)'
+        )
+
+    def handle(self, *args, **options):
+        indexed = rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} messages'))
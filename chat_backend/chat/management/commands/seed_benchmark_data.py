@@ -0,0 +1,63 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.seeding import DEFAULT_PREFIX, TIERS, clear_dataset, seed_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a synthetic dataset of users, rooms, messages and notifications for benchmarking. '
+        'Start from a size tier and override individual counts as needed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tier', choices=TIERS, default='small', help='Dataset size preset (default: small)')
+        parser.add_argument('--users', type=int, help='Number of users (overrides the tier)')
+        parser.add_argument('--rooms', type=int, help='Number of rooms (overrides the tier)')
+        parser.add_argument('--messages', type=int, help='Number of messages (overrides the tier)')
+        parser.add_argument('--notifications', type=int, help='Number of notifications (overrides the tier)')
+        parser.add_argument('--members-per-room', type=int, default=20, help='Members of each room (default: 20)')
+        parser.add_argument('--days', type=int, default=90, help='Spread messages over this many days (default: 90)')
+        parser.add_argument('--prefix', default=DEFAULT_PREFIX, help=f'Name prefix of seeded users and rooms (default: {DEFAULT_PREFIX})')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for reproducible datasets (default: 0)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT (default: 5000)')
+        parser.add_argument('--clear', action='store_true', help='Delete a previously seeded dataset with this prefix first')
+        parser.add_argument('--clear-only', action='store_true', help='Delete the seeded dataset and exit')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if not prefix:
+            raise CommandError('A non-empty --prefix is required so seeded data can be told apart')
+
+        if options['clear'] or options['clear_only']:
+            deleted = clear_dataset(prefix)
+            self.stdout.write(f"Deleted {deleted['users']} users and {deleted['rooms']} rooms with prefix {prefix!r}")
+            if options['clear_only']:
+                return
+
+        sizes = dict(TIERS[options['tier']])
+        for name in sizes:
+            if options[name] is not None:
+                sizes[name] = options[name]
+
+        last_report = {}
+
+        def progress(name, created, total):
+            now = time.monotonic()
+            if created == total or now - last_report.get(name, 0) >= 5:
+                last_report[name] = now
+                self.stdout.write(f'  {name}: {created}/{total}')
+
+        started = time.monotonic()
+        created = seed_dataset(
+            members_per_room=options['members_per_room'],
+            days=options['days'],
+            prefix=prefix,
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+            progress=progress,
+            **sizes
+        )
+        summary = ', '.join(f'{count} {name}' for name, count in created.items())
+        self.stdout.write(self.style.SUCCESS(f'Seeded {summary} in {time.monotonic() - started:.1f}s'))
@@ -0,0 +1,120 @@
+import glob
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.benchmarking import percentile
+
+
+class Command(BaseCommand):
+    help = 'Summarize where traced messages spent their time, per pipeline stage and end to end'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*',
+            help='Trace files to read (default: CHAT_TRACE_FILE and its rotated backups)'
+        )
+        parser.add_argument('--slowest', type=int, default=5, help='Show the N slowest traces (default: 5)')
+
+    def handle(self, *args, **options):
+        paths = options['paths']
+        if not paths:
+            trace_file = str(getattr(settings, 'CHAT_TRACE_FILE', settings.BASE_DIR / 'logs' / 'traces.jsonl'))
+            paths = sorted(glob.glob(f'{trace_file}.*'), reverse=True) + [trace_file]
+
+        traces = defaultdict(list)
+        skipped = 0
+        for path in paths:
+            try:
+                with open(path) as trace_log:
+                    for line in trace_log:
+                        try:
+                            record = json.loads(line)
+                            traces[record['trace']].append(record)
+                        except (ValueError, KeyError, TypeError):
+                            skipped += 1
+            except FileNotFoundError:
+                if options['paths']:
+                    raise CommandError(f'No such file: {path}')
+
+        if not traces:
+            self.stdout.write('No traces found')
+            return
+
+        self.stdout.write(f'{len(traces)} traces' + (f', {skipped} unreadable lines skipped' if skipped else ''))
+        self.write_stages(traces)
+        journeys = [self.journey(trace_id, records) for trace_id, records in traces.items()]
+        journeys = [journey for journey in journeys if journey is not None]
+        self.write_journeys(journeys, options['slowest'])
+
+    def write_stages(self, traces):
+        # Stage durations per handler, in the order stages first appear
+        stages = defaultdict(dict)
+        for records in traces.values():
+            for record in records:
+                handler_stages = stages[record['handler']]
+                for span in sorted(record['spans'], key=lambda span: span['start']):
+                    handler_stages.setdefault(span['name'], []).append(span['ms'])
+
+        for handler in ('receive', 'chat_message'):
+            if handler not in stages:
+                continue
+            durations = stages[handler]
+            total = sum(durations.get(handler, [])) or None
+            self.stdout.write('')
+            self.stdout.write(f"{handler:<24}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}{'share':>8}")
+            names = [handler] + [name for name in durations if name != handler]
+            for name in names:
+                values = durations.get(name)
+                if not values:
+                    continue
+                mean = sum(values) / len(values)
+                share = f'{sum(values) / total:.0%}' if total and name not in (handler, 'transit') else ''
+                label = name if name == handler else f'  {name}'
+                self.stdout.write(
+                    f'{label:<24}{len(values):>8}{percentile(values, 0.50):>10.3f}'
+                    f'{percentile(values, 0.99):>10.3f}{mean:>10.3f}{share:>8}'
+                )
+
+    def journey(self, trace_id, records):
+        """End-to-end view of one message: receive start to its last delivery"""
+        senders = [record for record in records if record['handler'] == 'receive']
+        deliveries = [record for record in records if record['handler'] == 'chat_message']
+        if not senders or not deliveries:
+            return None
+        start = min(span['start'] for span in senders[0]['spans'])
+        end = max(span['start'] + span['ms'] / 1000 for record in deliveries for span in record['spans'])
+        return {
+            'trace': trace_id,
+            'ms': (end - start) * 1000,
+            'recipients': len(deliveries),
+            'processes': len({record['pid'] for record in records}),
+            'receive': {span['name']: span['ms'] for span in senders[0]['spans']},
+            'slowest_delivery': max(
+                ({span['name']: span['ms'] for span in record['spans']} for record in deliveries),
+                key=lambda spans: spans.get('transit', 0) + spans.get('chat_message', 0)
+            ),
+        }
+
+    def write_journeys(self, journeys, slowest):
+        self.stdout.write('')
+        if not journeys:
+            self.stdout.write('No trace has both its receive and a delivery recorded')
+            return
+        durations = [journey['ms'] for journey in journeys]
+        self.stdout.write(
+            f'End to end, receive to last delivery: {len(journeys)} traces, '
+            f'p50 {percentile(durations, 0.50):.3f} ms, p99 {percentile(durations, 0.99):.3f} ms'
+        )
+        for journey in sorted(journeys, key=lambda journey: journey['ms'], reverse=True)[:slowest]:
+            self.stdout.write(
+                f"\n{journey['trace']}: {journey['ms']:.3f} ms, "
+                f"{journey['recipients']} recipients in {journey['processes']} processes"
+            )
+            self.stdout.write('  receive:  ' + self.format_spans(journey['receive']))
+            self.stdout.write('  slowest delivery:  ' + self.format_spans(journey['slowest_delivery']))
+
+    def format_spans(self, spans):
+        return ', '.join(f'{name} {ms:.3f}' for name, ms in spans.items())
@@ -0,0 +1,188 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.encoding import filepath_to_uri
+from django.utils.http import http_date, parse_etags
+
+from .models import CONTENT_ADDRESSED_PREFIX, ArchivedFile, ChatMessage, UserRoom
+
+# Storage prefixes the media endpoint serves
+SERVED_PREFIXES = ('chat_files/', 'chat_thumbnails/')
+
+# Prefixes whose files never change once written
+IMMUTABLE_PREFIXES = (CONTENT_ADDRESSED_PREFIX, 'chat_thumbnails/sha256/')
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def media_url(name):
+    """URL of a stored chat file on the authenticated media endpoint"""
+    return getattr(settings, 'CHAT_MEDIA_URL', settings.MEDIA_URL) + filepath_to_uri(name)
+
+
+def resolve_media_path(name):
+    """Return the absolute path of a servable file, or None"""
+    if not name.startswith(SERVED_PREFIXES):
+        return None
+    root = os.path.realpath(settings.MEDIA_ROOT)
+    path = os.path.realpath(os.path.join(root, name))
+    if not path.startswith(root + os.sep) or not os.path.isfile(path):
+        return None
+    return path
+
+
+def can_access_media(user, name):
+    """Whether ``user`` belongs to a room with a message owning the stored file.
+
+    Attachments are owned through ``ChatMessage.file``, or ``ArchivedFile``
+    once the message is archived; a thumbnail through the message whose file
+    it was rendered from (see ``thumbnail_name``).
+    """
+    if name.startswith('chat_thumbnails/'):
+        stem = 'chat_files/' + name[len('chat_thumbnails/'):].rsplit('_', 1)[0]
+        lookup = Q(file=stem) | Q(file__startswith=stem + '.')
+    else:
+        stem = None
+        lookup = Q(file=name)
+    rooms = UserRoom.objects.filter(user=user).values('room_id')
+    for owners in (
+        ChatMessage.objects.filter(lookup, room_id__in=rooms),
+        ArchivedFile.objects.filter(lookup, segment__room_id__in=rooms),
+    ):
+        files = owners.values_list('file', flat=True)
+        if stem is None:
+            if files.exists():
+                return True
+        # The prefix also matches longer names that share the stem
+        elif any(os.path.splitext(file)[0] == stem for file in files.distinct()):
+            return True
+    return False
+
+
+def media_etag(name, stat):
+    """Strong validator: the content hash for content-addressed files, else mtime and size"""
+    if name.startswith(IMMUTABLE_PREFIXES):
+        return '"%s"' % os.path.splitext(os.path.basename(name))[0]
+    return '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+
+
+def parse_range(header, size):
+    """Parse a single ``bytes=`` range into inclusive ``(start, end)``.
+
+    Returns None when the whole file should be sent (no, malformed or
+    multi-part range) and raises ValueError when the range is unsatisfiable.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            raise ValueError('Range starts past the end of the file')
+        end = int(last) if last else size - 1
+        return start, min(end, size - 1)
+    if last:
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError('Empty suffix range')
+        return max(size - length, 0), size - 1
+    return None
+
+
+class RangedFile:
+    """A window of an open file.
+
+    The underlying file is positioned at the start of the window, so WSGI
+    servers that hand ``fileno()`` to ``sendfile`` (via ``wsgi.file_wrapper``)
+    send the window without copying it through Python. ASGI servers such as
+    daphne always stream through ``read``, which stops at the end of the
+    window; use ``CHAT_MEDIA_ACCEL_REDIRECT`` to keep bodies off the workers.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.name = file.name
+        self.remaining = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def serve_media(request, name, path):
+    """Build the response for a stored file honouring conditional and range requests.
+
+    With ``CHAT_MEDIA_ACCEL_REDIRECT`` set the body is left to the front-end
+    server through ``X-Accel-Redirect``; it then also handles ranges itself.
+    """
+    stat = os.stat(path)
+    etag = media_etag(name, stat)
+    if name.startswith(IMMUTABLE_PREFIXES):
+        cache_control = f"private, max-age={getattr(settings, 'CHAT_MEDIA_MAX_AGE', 31536000)}, immutable"
+    else:
+        cache_control = 'private, no-cache'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': cache_control,
+        'Accept-Ranges': 'bytes',
+    }
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        tags = parse_etags(if_none_match)
+        if '*' in tags or etag in tags or f'W/{etag}' in tags:
+            response = HttpResponseNotModified()
+            for header, value in headers.items():
+                response[header] = value
+            return response
+
+    accel_prefix = getattr(settings, 'CHAT_MEDIA_ACCEL_REDIRECT', None)
+    if accel_prefix:
+        response = HttpResponse(content_type=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+        response['X-Accel-Redirect'] = accel_prefix + filepath_to_uri(name)
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if if_range is not None and if_range != etag:
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, stat.st_size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+
+    file = open(path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file)
+    else:
+        start, end = byte_range
+        response = FileResponse(RangedFile(file, start, end - start + 1), status=206)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    for header, value in headers.items():
+        response[header] = value
+    return response
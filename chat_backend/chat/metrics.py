@@ -0,0 +1,280 @@
+"""In-process metrics in the Prometheus text exposition format.
+
+Counters, gauges and histograms live in a process-wide registry and are
+rendered by the scrape endpoint. Each ASGI worker process keeps its own
+numbers, so every worker is scraped as a separate target. Recording is a dict
+lookup and a short uncontended lock, cheap enough to leave on at full load;
+bind labelled children once (``metric.labels(...)``) on hot paths.
+"""
+import bisect
+import functools
+import math
+import threading
+import time
+
+from channels.db import database_sync_to_async as channels_database_sync_to_async
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Latency buckets in seconds, from sub-millisecond handlers to slow queries
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric {metric.name} is already registered')
+            self._metrics[metric.name] = metric
+
+    def render(self):
+        """All metrics in the text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {escape_help(metric.documentation)}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for suffix, labels, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for name, value in labels
+    )
+    return '{' + pairs + '}'
+
+
+def format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        if value.is_integer():
+            return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    """Base class: a named family of children, one per label value tuple"""
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self.new_child()
+        registry.register(self)
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}')
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self.new_child())
+        return child
+
+    def remove(self, *values):
+        """Drop a child, e.g. the gauge of a room that no longer has connections"""
+        with self._lock:
+            self._children.pop(tuple(str(value) for value in values), None)
+
+    def children(self):
+        with self._lock:
+            items = list(self._children.items())
+        for values, child in items:
+            yield tuple(zip(self.labelnames, values)), child
+
+    def samples(self):
+        for labels, child in self.children():
+            yield '', labels, child.value
+
+    def __getattr__(self, name):
+        # Unlabelled metrics record straight through to their only child
+        children = self.__dict__.get('_children', {})
+        if () in children:
+            return getattr(children[()], name)
+        raise AttributeError(name)
+
+
+class CounterValue:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class GaugeValue(CounterValue):
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        """Context manager observing the duration of its block"""
+        return Timer(self)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def new_child(self):
+        return CounterValue()
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def new_child(self):
+        return GaugeValue()
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def new_child(self):
+        return HistogramValue(self.buckets)
+
+    def samples(self):
+        for labels, child in self.children():
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield '_bucket', labels + (('le', format_value(float(bound))),), cumulative
+            yield '_sum', labels, total
+            yield '_count', labels, cumulative
+
+
+# WebSocket
+websocket_connections = Gauge(
+    'chat_websocket_connections', 'Open WebSocket connections in this process'
+)
+websocket_room_connections = Gauge(
+    'chat_websocket_room_connections', 'Open WebSocket connections in this process per room', ['room']
+)
+websocket_frames = Counter(
+    'chat_websocket_frames_total', 'WebSocket frames received and sent', ['direction']
+)
+frames_in = websocket_frames.labels('in')
+frames_out = websocket_frames.labels('out')
+throttled_frames = Counter(
+    'chat_websocket_throttled_frames_total', 'Inbound WebSocket frames refused by rate limits'
+)
+websocket_handler_seconds = Histogram(
+    'chat_websocket_handler_seconds', 'Time spent in consumer handlers', ['handler']
+)
+receive_seconds = websocket_handler_seconds.labels('receive')
+chat_message_seconds = websocket_handler_seconds.labels('chat_message')
+group_send_seconds = Histogram(
+    'chat_group_send_seconds', 'Latency of channel layer group_send calls'
+)
+
+# Database work run off the event loop
+db_call_seconds = Histogram(
+    'chat_db_call_seconds', 'Time spent running database_sync_to_async functions', ['function']
+)
+db_calls_pending = Gauge(
+    'chat_db_calls_pending', 'database_sync_to_async calls waiting for a worker thread'
+)
+
+# HTTP
+http_request_seconds = Histogram(
+    'chat_http_request_seconds', 'HTTP request latency per view', ['view', 'method']
+)
+http_responses = Counter(
+    'chat_http_responses_total', 'HTTP responses per view and status code', ['view', 'status']
+)
+upload_bytes = Counter(
+    'chat_upload_bytes_total', 'Attachment bytes received', ['kind']
+)
+
+
+def database_sync_to_async(func):
+    """``channels.db.database_sync_to_async`` that records time and queueing.
+
+    Observes how long ``func`` ran on the worker thread, and counts calls that
+    are waiting for the thread in ``chat_db_calls_pending``.
+    """
+    seconds = db_call_seconds.labels(func.__qualname__)
+
+    def run(started, *args, **kwargs):
+        if started.acquire(blocking=False):
+            db_calls_pending.dec()
+        with seconds.time():
+            return func(*args, **kwargs)
+
+    threaded = channels_database_sync_to_async(run)
+
+    @functools.wraps(func)
+    async def call(*args, **kwargs):
+        # Released by whichever comes first: the thread starting the call, or
+        # the caller giving up on it
+        started = threading.Lock()
+        db_calls_pending.inc()
+        try:
+            return await threaded(started, *args, **kwargs)
+        finally:
+            if started.acquire(blocking=False):
+                db_calls_pending.dec()
+
+    return call
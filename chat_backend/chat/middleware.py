@@ -0,0 +1,136 @@
+import hmac
+import logging
+import time
+from urllib.parse import parse_qs
+
+from channels.auth import AuthMiddlewareStack
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import metrics
+from .cache import LRUCache
+from .metrics import database_sync_to_async
+
+User = get_user_model()
+
+logger = logging.getLogger('chat.websocket')
+security_logger = logging.getLogger('chat.security')
+
+# Subprotocol marker; the client offers ["bearer", "<token>", ...]
+TOKEN_SUBPROTOCOL = 'bearer'
+
+# Verified tokens keyed by jti: (raw token, user, expiry timestamp)
+token_cache = LRUCache(maxsize=getattr(settings, 'CHAT_AUTH_CACHE_SIZE', 50000))
+
+
+def get_token_from_scope(scope):
+    """Extract a raw JWT from the header, query string or subprotocol list.
+
+    Returns a ``(token, subprotocol)`` pair where ``subprotocol`` is the marker
+    the consumer must echo back when the token came in as a subprotocol.
+    """
+    headers = dict(scope.get('headers', []))
+    auth_header = headers.get(b'authorization', b'').decode('latin1')
+    if auth_header.startswith('Bearer '):
+        return auth_header.split(' ', 1)[1].strip(), None
+
+    query = parse_qs(scope.get('query_string', b'').decode('latin1'))
+    if query.get('token'):
+        return query['token'][0], None
+
+    subprotocols = scope.get('subprotocols') or []
+    if TOKEN_SUBPROTOCOL in subprotocols:
+        index = subprotocols.index(TOKEN_SUBPROTOCOL)
+        if index + 1 < len(subprotocols):
+            return subprotocols[index + 1], TOKEN_SUBPROTOCOL
+
+    return None, None
+
+
+@database_sync_to_async
+def get_user(user_id):
+    try:
+        return User.objects.get(**{jwt_settings.USER_ID_FIELD: user_id}, is_active=True)
+    except User.DoesNotExist:
+        return None
+
+
+async def authenticate_token(raw_token):
+    """Return the user for a raw access token, or None if it is not valid.
+
+    A token that has been verified before is matched against the cache by its
+    ``jti`` and served without a database query until it expires. Users
+    deactivated during that window keep their session until the token lapses,
+    the same guarantee the token itself gives.
+    """
+    try:
+        token = AccessToken(raw_token)
+    except TokenError as e:
+        security_logger.warning(f"Failed JWT authentication attempt: {str(e)}")
+        return None
+
+    jti = token.get(jwt_settings.JTI_CLAIM)
+    now = time.time()
+    cached = token_cache.get(jti) if jti else None
+    if cached is not None:
+        cached_token, user, expires_at = cached
+        if expires_at > now and hmac.compare_digest(cached_token, raw_token):
+            return user
+        token_cache.invalidate(jti)
+
+    user_id = token.get(jwt_settings.USER_ID_CLAIM)
+    user = await get_user(user_id) if user_id is not None else None
+    if user is None:
+        security_logger.warning(f"JWT for unknown or inactive user_id: {user_id}")
+        return None
+
+    if jti:
+        token_cache.set(jti, (raw_token, user, token.get('exp', now)))
+    logger.info(f"JWT authentication successful for user_id: {user_id}")
+    return user
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """Populate ``scope['user']`` from a JWT access token.
+
+    Connections without a token keep whatever user the session middleware
+    resolved. When the token was offered as a subprotocol, the marker is stored
+    in ``scope['auth_subprotocol']`` so the consumer can accept with it.
+    """
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        raw_token, subprotocol = get_token_from_scope(scope)
+        if raw_token:
+            user = await authenticate_token(raw_token)
+            if user is not None:
+                scope['user'] = user
+                scope['auth_subprotocol'] = subprotocol
+        return await super().__call__(scope, receive, send)
+
+
+def JWTAuthMiddlewareStack(inner):
+    return AuthMiddlewareStack(JWTAuthMiddleware(inner))
+
+
+class RequestMetricsMiddleware:
+    """Record latency and status of HTTP requests per resolved view"""
+
+    methods = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        method = request.method if request.method in self.methods else 'other'
+        metrics.http_request_seconds.labels(view, method).observe(time.perf_counter() - started)
+        metrics.http_responses.labels(view, response.status_code).inc()
+        return response
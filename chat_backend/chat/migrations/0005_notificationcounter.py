@@ -0,0 +1,51 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_counters(apps, schema_editor):
+    Notification = apps.get_model('chat', 'Notification')
+    NotificationCounter = apps.get_model('chat', 'NotificationCounter')
+    unread = (
+        Notification.objects.filter(is_read=False)
+        .values('recipient_id', 'notification_type')
+        .annotate(unread_count=Count('id'))
+    )
+    NotificationCounter.objects.bulk_create(
+        [
+            NotificationCounter(
+                user_id=row['recipient_id'],
+                notification_type=row['notification_type'],
+                unread_count=row['unread_count']
+            )
+            for row in unread.iterator()
+        ],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_chatmessage_chat_chatme_room_id_6e4daa_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('notification_type', models.CharField(choices=[('message', 'New Message'), ('mention', 'Mention'), ('reaction', 'Reaction'), ('typing', 'Typing'), ('system', 'System')], max_length=20)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notification_counters', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'notification_type')},
+            },
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:25
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        # The index keeps its own copy of the text: an external-content FTS5
+        # table needs the exact indexed text to remove a row, and is corrupted
+        # by removing rows it never indexed
+        schema_editor.execute("CREATE VIRTUAL TABLE chat_message_fts USING fts5(message)")
+        schema_editor.execute(
+            "INSERT INTO chat_message_fts(rowid, message) "
+            "SELECT id, message FROM chat_chatmessage WHERE message IS NOT NULL"
+        )
+    elif vendor == 'postgresql':
+        config = getattr(settings, 'CHAT_SEARCH_CONFIG', 'simple')
+        schema_editor.execute(
+            "UPDATE chat_chatmessage SET search_vector = to_tsvector(%s::regconfig, COALESCE(message, ''))",
+            [config]
+        )
+        schema_editor.execute(
+            "CREATE INDEX chat_chatmessage_search_gin ON chat_chatmessage USING gin (search_vector)"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS chat_message_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS chat_chatmessage_search_gin")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_chatmessage_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
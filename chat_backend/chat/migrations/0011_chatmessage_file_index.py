@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_archivesegment'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='file',
+            field=models.FileField(blank=True, db_index=True, null=True, upload_to='chat_files/%Y/%m/%d/'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:55
+
+import chat.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_chatmessage_file_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True, default=chat.models.upload_expiry),
+        ),
+    ]
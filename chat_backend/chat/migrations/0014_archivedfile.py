@@ -0,0 +1,48 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:08
+
+import gzip
+import json
+import os
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def record_archived_files(apps, schema_editor):
+    """Record the files of messages archived before this table existed"""
+    ArchiveSegment = apps.get_model('chat', 'ArchiveSegment')
+    ArchivedFile = apps.get_model('chat', 'ArchivedFile')
+    root = getattr(settings, 'CHAT_ARCHIVE_ROOT', settings.BASE_DIR / 'archive')
+    for segment in ArchiveSegment.objects.all():
+        try:
+            with gzip.open(os.path.join(root, segment.path), 'rt', encoding='utf-8') as lines:
+                files = {json.loads(line).get('file') for line in lines}
+        except FileNotFoundError:
+            continue
+        ArchivedFile.objects.bulk_create(
+            [ArchivedFile(segment=segment, file=file) for file in files if file],
+            ignore_conflicts=True
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_attachmentupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.CharField(db_index=True, max_length=255)),
+                ('segment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='files', to='chat.archivesegment')),
+            ],
+            options={
+                'unique_together': {('segment', 'file')},
+            },
+        ),
+        migrations.RunPython(record_archived_files, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,106 @@
+import os
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import F, Q
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 
+# Storage prefix of deduplicated attachments
+CONTENT_ADDRESSED_PREFIX = 'chat_files/sha256/'
+
+
+class Attachment(models.Model):
+    """A stored attachment blob, addressed by the SHA-256 of its content.
+
+    Identical uploads share one file. The hash is always computed by the
+    server from the stored bytes. ``ref_count`` tracks how many
+    ``ChatMessage`` rows point at it; the blob is deleted when the last one
+    goes away, and blobs that were uploaded but never sent are collected by
+    ``manage.py cleanup_uploads`` after a grace period.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(max_length=255)
+    size = models.BigIntegerField()
+    mime_type = models.CharField(max_length=100)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.sha256[:12]} ({self.size} bytes, {self.ref_count} refs)'
+
+    @classmethod
+    def accessible_to(cls, user_id):
+        """Attachments a user may reference by hash.
+
+        Knowing a hash is not proof of having the content: only blobs the user
+        uploaded, or that were already sent to one of their rooms (including
+        archived messages), qualify.
+        """
+        rooms = UserRoom.objects.filter(user_id=user_id).values('room_id')
+        return cls.objects.filter(
+            Q(uploads__user_id=user_id) |
+            Q(file__in=ChatMessage.objects.filter(room_id__in=rooms).values('file')) |
+            Q(file__in=ArchivedFile.objects.filter(segment__room_id__in=rooms).values('file'))
+        ).distinct()
+
+    @classmethod
+    def link(cls, chat_messages, file_infos):
+        """Point messages at the attachments named in their file info.
+
+        Sets ``file`` and the stored size on each message whose file info
+        carries a ``sha256`` its sender may reference (see ``accessible_to``)
+        and adds the references in one UPDATE per attachment. Call before the
+        messages are saved.
+        """
+        wanted = {}
+        for chat_message, info in zip(chat_messages, file_infos):
+            sha256 = info.get('sha256') if isinstance(info, dict) else None
+            if isinstance(sha256, str):
+                wanted.setdefault(chat_message.user_id, set()).add(sha256)
+        if not wanted:
+            return
+        attachments = {}
+        for user_id, hashes in wanted.items():
+            for sha256, file_name, size in cls.accessible_to(user_id).filter(
+                sha256__in=hashes
+            ).values_list('sha256', 'file', 'size'):
+                attachments[user_id, sha256] = file_name, size
+        references = Counter()
+        for chat_message, info in zip(chat_messages, file_infos):
+            sha256 = info.get('sha256') if isinstance(info, dict) else None
+            stored = attachments.get((chat_message.user_id, sha256))
+            if stored:
+                chat_message.file.name, chat_message.file_size = stored
+                references[sha256] += 1
+        for sha256, amount in references.items():
+            cls.objects.filter(sha256=sha256).update(ref_count=F('ref_count') + amount)
+
+
+class AttachmentUpload(models.Model):
+    """A user's upload of an attachment's content.
+
+    Lets the uploader reference the blob by hash, and keeps an unsent blob
+    from being collected until the grace period after its latest upload.
+    """
+    attachment = models.ForeignKey(Attachment, on_delete=models.CASCADE, related_name='uploads')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='attachment_uploads')
+    uploaded_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ['attachment', 'user']
+
+    def __str__(self):
+        return f'{self.attachment.sha256[:12]} by {self.user.username}'
+
+
 class ChatRoom(models.Model):
     name = models.CharField(max_length=100, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -23,14 +122,22 @@ class ChatMessage(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='messages')
     message = models.TextField(blank=True, null=True)
     message_type = models.CharField(max_length=10, choices=MESSAGE_TYPES, default='text')
-    file = models.FileField(upload_to='chat_files/%Y/%m/%d/', blank=True, null=True)
+    # Indexed for the media endpoint's access check
+    file = models.FileField(upload_to='chat_files/%Y/%m/%d/', blank=True, null=True, db_index=True)
     file_name = models.CharField(max_length=255, blank=True, null=True)
     file_size = models.IntegerField(blank=True, null=True)
     mime_type = models.CharField(max_length=100, blank=True, null=True)
+    # Rendered thumbnails as {size: storage name}, filled in by the thumbnail pipeline
+    thumbnails = models.JSONField(default=dict, blank=True)
+    # Full-text index of ``message`` on Postgres; SQLite uses an FTS5 table instead
+    search_vector = SearchVectorField(null=True, editable=False)
     timestamp = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['room', 'timestamp', 'id']),
+        ]
     
     def __str__(self):
         if self.message_type == 'text':
@@ -61,12 +168,14 @@ class Notification(models.Model):
     ]
     
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
-    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_notifications', null=True, blank=True)
+    # Deleting the sender or the message keeps the notification, so unread
+    # counts in NotificationCounter stay in step with the rows
+    sender = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='sent_notifications', null=True, blank=True)
     notification_type = models.CharField(max_length=20, choices=NOTIFICATION_TYPES)
     title = models.CharField(max_length=200)
     message = models.TextField()
     is_read = models.BooleanField(default=False)
-    related_message = models.ForeignKey(ChatMessage, on_delete=models.CASCADE, null=True, blank=True)
+    related_message = models.ForeignKey(ChatMessage, on_delete=models.SET_NULL, null=True, blank=True)
     room_name = models.CharField(max_length=100, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -75,6 +184,8 @@ class Notification(models.Model):
         indexes = [
             models.Index(fields=['recipient', 'is_read']),
             models.Index(fields=['created_at']),
+            # Keyset pages of a recipient's feed (see FeedPagination)
+            models.Index(fields=['recipient', 'created_at', 'id']),
         ]
     
     def __str__(self):
@@ -88,4 +199,170 @@ class UserPresence(models.Model):
     current_room = models.CharField(max_length=100, null=True, blank=True)
     
     def __str__(self):
-        return f'{self.user.username}: {"online" if self.is_online else "offline"}'
\ No newline at end of file
+        return f'{self.user.username}: {"online" if self.is_online else "offline"}'
+
+
+class NotificationCounter(models.Model):
+    """Denormalized unread notification count per user and notification type.
+
+    Kept in step with ``Notification`` rows wherever they are created or
+    marked read, so badge counts never scan a user's notification history.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notification_counters')
+    notification_type = models.CharField(max_length=20, choices=Notification.NOTIFICATION_TYPES)
+    unread_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['user', 'notification_type']
+
+    def __str__(self):
+        return f'{self.user.username}: {self.unread_count} unread {self.notification_type}'
+
+    @classmethod
+    def increment(cls, notifications):
+        """Count newly created unread notifications"""
+        per_recipient = Counter(
+            (notification.recipient_id, notification.notification_type)
+            for notification in notifications
+            if not notification.is_read
+        )
+        # Recipients that received the same number of the same type share one UPDATE
+        groups = {}
+        for (user_id, notification_type), amount in per_recipient.items():
+            groups.setdefault((notification_type, amount), []).append(user_id)
+
+        for (notification_type, amount), user_ids in groups.items():
+            cls.objects.bulk_create(
+                [cls(user_id=user_id, notification_type=notification_type) for user_id in user_ids],
+                ignore_conflicts=True
+            )
+            cls.objects.filter(
+                user_id__in=user_ids,
+                notification_type=notification_type
+            ).update(unread_count=F('unread_count') + amount)
+
+    @classmethod
+    def decrement(cls, user_id, notification_type, amount=1):
+        cls.objects.filter(
+            user_id=user_id,
+            notification_type=notification_type,
+            unread_count__gte=amount
+        ).update(unread_count=F('unread_count') - amount)
+
+    @classmethod
+    def reset(cls, user_id):
+        cls.objects.filter(user_id=user_id).exclude(unread_count=0).update(unread_count=0)
+
+    @classmethod
+    def counts_for(cls, user_id):
+        """Return ``{'total': n, 'by_type': {type: n}}`` for a user"""
+        by_type = dict(
+            cls.objects.filter(user_id=user_id, unread_count__gt=0)
+            .values_list('notification_type', 'unread_count')
+        )
+        return {'total': sum(by_type.values()), 'by_type': by_type}
+
+
+def upload_expiry():
+    """Expiry of a resumable upload that has just received bytes"""
+    return timezone.now() + timedelta(seconds=getattr(settings, 'CHAT_RESUMABLE_UPLOAD_EXPIRY', 24 * 60 * 60))
+
+
+class ChunkedUpload(models.Model):
+    """An attachment being uploaded in chunks that can resume after a drop.
+
+    Received bytes are appended to a partial file under
+    ``MEDIA_ROOT/chat_uploads`` and ``offset`` records how many have been
+    stored, so a client can ask for it and continue from there. Every chunk
+    pushes ``expires_at`` back; expired uploads are gone for the client and
+    removed with their partial file by ``manage.py cleanup_uploads``.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chunked_uploads')
+    file_name = models.CharField(max_length=255)
+    mime_type = models.CharField(max_length=100)
+    total_size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    expires_at = models.DateTimeField(default=upload_expiry, db_index=True)
+
+    def __str__(self):
+        return f'{self.file_name} ({self.offset}/{self.total_size}) by {self.user.username}'
+
+    @property
+    def partial_path(self):
+        return os.path.join(settings.MEDIA_ROOT, 'chat_uploads', f'{self.id}.part')
+
+    @property
+    def is_complete(self):
+        return self.offset >= self.total_size
+
+
+class ArchiveSegment(models.Model):
+    """Index entry of a compressed file holding one month of a room's archived messages"""
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='archive_segments')
+    month = models.DateField()
+    path = models.CharField(max_length=255)
+    message_count = models.PositiveIntegerField(default=0)
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['room', 'month']
+        ordering = ['room', 'month']
+
+    def __str__(self):
+        return f'{self.room.name} {self.month:%Y-%m} ({self.message_count} messages)'
+
+    @property
+    def full_path(self):
+        return os.path.join(getattr(settings, 'CHAT_ARCHIVE_ROOT', settings.BASE_DIR / 'archive'), self.path)
+
+
+class ArchivedFile(models.Model):
+    """A stored file referenced by a message in an archive segment.
+
+    Archived messages keep their attachments, so these rows let the media
+    endpoint keep serving them to the room without reading segment files.
+    """
+    segment = models.ForeignKey(ArchiveSegment, on_delete=models.CASCADE, related_name='files')
+    file = models.CharField(max_length=255, db_index=True)
+
+    class Meta:
+        unique_together = ['segment', 'file']
+
+    def __str__(self):
+        return f'{self.file} in {self.segment}'
+
+
+@receiver(post_delete, sender=ArchiveSegment)
+def delete_segment_file(sender, instance, **kwargs):
+    try:
+        os.remove(instance.full_path)
+    except FileNotFoundError:
+        pass
+
+
+@receiver(post_delete, sender=ChunkedUpload)
+def delete_partial_file(sender, instance, **kwargs):
+    try:
+        os.remove(instance.partial_path)
+    except FileNotFoundError:
+        pass
+
+
+@receiver(post_delete, sender=ChatMessage)
+def release_attachment(sender, instance, **kwargs):
+    """Drop a message's reference to its attachment and delete unused blobs"""
+    if not instance.file or not instance.file.name.startswith(CONTENT_ADDRESSED_PREFIX):
+        return
+    sha256 = os.path.splitext(os.path.basename(instance.file.name))[0]
+    Attachment.objects.filter(sha256=sha256, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+    unused = Attachment.objects.filter(sha256=sha256, ref_count=0).first()
+    if unused is not None:
+        unused.file.delete(save=False)
+        for name in instance.thumbnails.values():
+            unused.file.storage.delete(name)
+        unused.delete()
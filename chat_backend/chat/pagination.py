@@ -0,0 +1,212 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from . import archive
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination keyed on ``(ordering_field, id)``.
+
+    Pages are selected with a range condition on the ordering key instead of an
+    OFFSET, so every page is a bounded scan of an index such as
+    ``(room, timestamp, id)`` no matter how far back the client has scrolled.
+
+    Query parameters:
+        before: cursor of the oldest entry already shown; returns older entries
+        after: cursor of the newest entry already shown; returns newer entries
+        page_size: number of entries per page, capped at ``max_page_size``
+
+    Without a cursor the newest page is returned. Results are always in
+    ascending ``(ordering_field, id)`` order.
+    """
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    before_query_param = 'before'
+    after_query_param = 'after'
+    ordering_field = 'timestamp'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        limit = self.get_page_size(request)
+
+        before = request.query_params.get(self.before_query_param)
+        after = request.query_params.get(self.after_query_param)
+        field = self.ordering_field
+
+        if after is not None:
+            position, pk = self.decode_cursor(after)
+            queryset = queryset.filter(
+                Q(**{f'{field}__gte': position}) &
+                (Q(**{f'{field}__gt': position}) | Q(id__gt=pk))
+            ).order_by(field, 'id')
+            page = list(queryset[:limit + 1])
+            self.has_newer = len(page) > limit
+            self.has_older = True
+            page = page[:limit]
+        else:
+            if before is not None:
+                position, pk = self.decode_cursor(before)
+                queryset = queryset.filter(
+                    Q(**{f'{field}__lte': position}) &
+                    (Q(**{f'{field}__lt': position}) | Q(id__lt=pk))
+                )
+            queryset = queryset.order_by(f'-{field}', '-id')
+            page = list(queryset[:limit + 1])
+            self.has_older = len(page) > limit
+            self.has_newer = before is not None
+            page = page[:limit]
+            page.reverse()
+
+        self.page = page
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'previous': self.get_previous_link(),
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_previous_link(self):
+        """Link to the page of older entries"""
+        if not self.has_older or not self.page:
+            return None
+        url = remove_query_param(self.base_url, self.after_query_param)
+        return replace_query_param(url, self.before_query_param, self.encode_cursor(self.page[0]))
+
+    def get_next_link(self):
+        """Link to the page of newer entries"""
+        if not self.has_newer or not self.page:
+            return None
+        url = remove_query_param(self.base_url, self.before_query_param)
+        return replace_query_param(url, self.after_query_param, self.encode_cursor(self.page[-1]))
+
+    def encode_cursor(self, instance):
+        position = self.format_position(getattr(instance, self.ordering_field))
+        raw = f'{position}|{instance.id}'
+        return urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, encoded):
+        try:
+            raw = urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8')
+            position, pk = raw.rsplit('|', 1)
+            return self.parse_position(position), int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def format_position(self, position):
+        return position.isoformat()
+
+    def parse_position(self, value):
+        return datetime.fromisoformat(value)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.before_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Cursor returning the page of older results',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.after_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Cursor returning the page of newer results',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results to return per page',
+                'schema': {'type': 'integer'},
+            },
+        ]
+
+
+class HistoryPagination(KeysetPagination):
+    """``KeysetPagination`` over a room's hot messages followed by its archive.
+
+    Pages come from the ``ChatMessage`` table until it runs out of older
+    messages; the rest of the page, and every older page, is read from the
+    room's archive segments. Cursors work the same across the boundary.
+    Requires a ``room_id`` URL keyword argument.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = super().paginate_queryset(queryset, request, view)
+        room_id = view.kwargs['room_id']
+        limit = self.get_page_size(request)
+
+        after = request.query_params.get(self.after_query_param)
+        if after is not None:
+            # Archived messages newer than the cursor precede every hot one
+            archived, more = archive.messages_after(room_id, self.decode_cursor(after), limit)
+            if archived:
+                combined = archived + page
+                self.has_newer = more or len(combined) > limit or self.has_newer
+                page = combined[:limit]
+        elif not self.has_older:
+            if page:
+                position = (page[0].timestamp, page[0].id)
+            else:
+                before = request.query_params.get(self.before_query_param)
+                position = self.decode_cursor(before) if before is not None else None
+            archived, self.has_older = archive.messages_before(room_id, position, limit - len(page))
+            page = archived + page
+
+        self.page = page
+        return page
+
+
+class FeedPagination(KeysetPagination):
+    """Newest-first variant of ``KeysetPagination`` for feeds.
+
+    Results come back in descending order; ``next`` links to older entries and
+    ``previous`` to newer ones.
+    """
+    page_size = 50
+    max_page_size = 100
+    ordering_field = 'created_at'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = super().paginate_queryset(queryset, request, view)
+        return page[::-1]
+
+    def get_paginated_response(self, data):
+        return Response({
+            'previous': self.get_next_link(),
+            'next': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class SearchPagination(FeedPagination):
+    """Best-match-first pagination of search results keyed on ``(rank, id)``"""
+    ordering_field = 'rank'
+
+    def format_position(self, position):
+        return repr(float(position))
+
+    def parse_position(self, value):
+        return float(value)
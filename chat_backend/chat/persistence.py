@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import weakref
+
+from django.conf import settings
+from django.db import transaction
+
+from .metrics import database_sync_to_async
+from .models import Attachment, ChatMessage
+from .search import index_messages
+
+logger = logging.getLogger('chat.websocket')
+
+
+class MessageBatcher:
+    """Write-behind queue that persists chat messages in batches.
+
+    Consumers ``submit`` a message and wait on the result. Pending messages are
+    written with a single ``bulk_create`` once ``batch_size`` of them have been
+    queued or ``flush_interval`` seconds after the first one arrived, whichever
+    comes first. Each caller is released only after its batch has committed, so
+    a message is never broadcast before it is stored. A batch that fails is
+    retried one message at a time.
+    """
+
+    def __init__(self, batch_size=100, flush_interval=0.005):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._timer = None
+
+    async def submit(self, user, room_id, message, message_type='text', file_info=None):
+        """Queue a message and return the saved ``ChatMessage`` once committed"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        chat_message = ChatMessage(
+            room_id=room_id,
+            user=user,
+            message=message,
+            message_type=message_type
+        )
+        if file_info:
+            chat_message.file_name = file_info.get('file_name')
+            chat_message.file_size = file_info.get('file_size')
+            chat_message.mime_type = file_info.get('mime_type')
+        chat_message.pending_file_info = file_info
+        self._pending.append((chat_message, future))
+
+        if len(self._pending) >= self.batch_size:
+            self._schedule_flush(0)
+        elif self._timer is None:
+            self._schedule_flush(self.flush_interval)
+
+        return await future
+
+    def _schedule_flush(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        loop = asyncio.get_running_loop()
+        self._timer = loop.call_later(delay, lambda: asyncio.ensure_future(self.flush()))
+
+    async def flush(self):
+        """Write every pending message in one transaction"""
+        self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        try:
+            await self._write_batch([chat_message for chat_message, _ in batch])
+        except Exception as e:
+            logger.error(f"Error writing message batch of {len(batch)}: {str(e)}")
+            if len(batch) > 1:
+                # Batches mix senders; retry one at a time so a bad row only
+                # fails its own sender
+                await self._write_each(batch)
+            elif not batch[0][1].done():
+                batch[0][1].set_exception(e)
+            return
+
+        logger.debug(f"Wrote message batch of {len(batch)}")
+        for chat_message, future in batch:
+            if not future.done():
+                future.set_result(chat_message)
+
+    async def _write_each(self, batch):
+        for chat_message, future in batch:
+            try:
+                await self._write_batch([chat_message])
+            except Exception as e:
+                logger.error(f"Error writing message from user {chat_message.user_id}: {str(e)}")
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            if not future.done():
+                future.set_result(chat_message)
+
+    @database_sync_to_async
+    def _write_batch(self, messages):
+        with transaction.atomic():
+            Attachment.link(messages, [chat_message.pending_file_info for chat_message in messages])
+            ChatMessage.objects.bulk_create(messages)
+            index_messages(messages)
+
+
+_batchers = weakref.WeakKeyDictionary()
+
+
+def write_behind_enabled():
+    return getattr(settings, 'CHAT_WRITE_BEHIND_ENABLED', False)
+
+
+def get_message_batcher():
+    """Return the batcher bound to the running event loop"""
+    loop = asyncio.get_running_loop()
+    batcher = _batchers.get(loop)
+    if batcher is None:
+        batcher = MessageBatcher(
+            batch_size=getattr(settings, 'CHAT_WRITE_BEHIND_BATCH_SIZE', 100),
+            flush_interval=getattr(settings, 'CHAT_WRITE_BEHIND_FLUSH_INTERVAL', 0.005)
+        )
+        _batchers[loop] = batcher
+    return batcher
@@ -0,0 +1,340 @@
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from .metrics import database_sync_to_async
+from .models import UserPresence
+
+logger = logging.getLogger('chat.websocket')
+
+
+class BasePresenceBackend:
+    """Fast store tracking live connections per user.
+
+    Every connection is registered under its channel name with an expiry
+    timestamp that heartbeats push forward. A user is online while at least one
+    unexpired connection is registered, so closing one of several tabs does not
+    mark them offline, and connections of a crashed worker simply lapse.
+
+    ``connect``, ``heartbeat`` and ``disconnect`` return True when the call
+    changed the user's online state.
+    """
+
+    # Whether calls do network I/O and must run off the event loop
+    blocking = False
+
+    def connect(self, user_id, channel_name, room, expires_at):
+        raise NotImplementedError
+
+    def heartbeat(self, user_id, channel_name, expires_at):
+        raise NotImplementedError
+
+    def disconnect(self, user_id, channel_name):
+        raise NotImplementedError
+
+    def get(self, user_id):
+        """Return ``{'is_online', 'current_room', 'last_seen'}`` or None if never seen"""
+        raise NotImplementedError
+
+    def online_user_ids(self):
+        raise NotImplementedError
+
+    def filter_online(self, user_ids):
+        """Return the subset of ``user_ids`` that is online"""
+        raise NotImplementedError
+
+    def expire(self):
+        """Drop lapsed connections and return the ids of users now offline"""
+        raise NotImplementedError
+
+
+class InMemoryPresenceBackend(BasePresenceBackend):
+    """Process-local presence store for single-node deployments"""
+
+    def __init__(self, **options):
+        self._connections = {}  # user_id -> {channel_name: expires_at}
+        self._rooms = {}  # user_id -> current room
+        self._last_seen = {}  # user_id -> timestamp
+        self._lock = threading.Lock()
+
+    def connect(self, user_id, channel_name, room, expires_at):
+        with self._lock:
+            connections = self._connections.setdefault(user_id, {})
+            became_online = not connections
+            connections[channel_name] = expires_at
+            self._rooms[user_id] = room
+            self._last_seen[user_id] = time.time()
+            return became_online
+
+    def heartbeat(self, user_id, channel_name, expires_at):
+        with self._lock:
+            connections = self._connections.setdefault(user_id, {})
+            became_online = not connections
+            connections[channel_name] = expires_at
+            self._last_seen[user_id] = time.time()
+            return became_online
+
+    def disconnect(self, user_id, channel_name):
+        with self._lock:
+            connections = self._connections.get(user_id)
+            if not connections or connections.pop(channel_name, None) is None:
+                return False
+            self._last_seen[user_id] = time.time()
+            if connections:
+                return False
+            del self._connections[user_id]
+            self._rooms.pop(user_id, None)
+            return True
+
+    def get(self, user_id):
+        with self._lock:
+            if user_id not in self._last_seen:
+                return None
+            return {
+                'is_online': user_id in self._connections,
+                'current_room': self._rooms.get(user_id),
+                'last_seen': self._last_seen[user_id],
+            }
+
+    def online_user_ids(self):
+        with self._lock:
+            return list(self._connections)
+
+    def filter_online(self, user_ids):
+        with self._lock:
+            return {user_id for user_id in user_ids if user_id in self._connections}
+
+    def expire(self):
+        now = time.time()
+        offline = []
+        with self._lock:
+            for user_id, connections in list(self._connections.items()):
+                for channel_name, expires_at in list(connections.items()):
+                    if expires_at <= now:
+                        del connections[channel_name]
+                if not connections:
+                    del self._connections[user_id]
+                    self._rooms.pop(user_id, None)
+                    offline.append(user_id)
+        return offline
+
+
+class RedisPresenceBackend(BasePresenceBackend):
+    """Presence store shared by every node through Redis.
+
+    Keys (all under ``prefix``):
+        conn:<user_id>  sorted set of channel names scored by expiry
+        online          sorted set of user ids scored by latest expiry
+        room            hash of user id -> current room
+        last_seen       hash of user id -> timestamp
+    """
+    blocking = True
+
+    def __init__(self, url='redis://127.0.0.1:6379', prefix='presence:', client=None, **options):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImproperlyConfigured('RedisPresenceBackend requires the redis package')
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, *parts):
+        return self.prefix + ':'.join(str(part) for part in parts)
+
+    def _register(self, pipe, user_id, channel_name, expires_at):
+        pipe.zadd(self._key('conn', user_id), {channel_name: expires_at})
+        pipe.expireat(self._key('conn', user_id), int(expires_at) + 1)
+        pipe.zadd(self._key('online'), {user_id: expires_at}, nx=True)
+        pipe.zadd(self._key('online'), {user_id: expires_at}, gt=True)
+        pipe.hset(self._key('last_seen'), user_id, time.time())
+
+    def connect(self, user_id, channel_name, room, expires_at):
+        pipe = self.client.pipeline()
+        self._register(pipe, user_id, channel_name, expires_at)
+        pipe.hset(self._key('room'), user_id, room or '')
+        results = pipe.execute()
+        return bool(results[2])
+
+    def heartbeat(self, user_id, channel_name, expires_at):
+        pipe = self.client.pipeline()
+        self._register(pipe, user_id, channel_name, expires_at)
+        results = pipe.execute()
+        return bool(results[2])
+
+    def disconnect(self, user_id, channel_name):
+        conn_key = self._key('conn', user_id)
+        pipe = self.client.pipeline()
+        pipe.zrem(conn_key, channel_name)
+        pipe.zremrangebyscore(conn_key, '-inf', time.time())
+        pipe.zcard(conn_key)
+        pipe.hset(self._key('last_seen'), user_id, time.time())
+        removed, _, remaining, _ = pipe.execute()
+        if not removed or remaining:
+            return False
+        pipe = self.client.pipeline()
+        pipe.zrem(self._key('online'), user_id)
+        pipe.hdel(self._key('room'), user_id)
+        pipe.execute()
+        return True
+
+    def get(self, user_id):
+        pipe = self.client.pipeline()
+        pipe.zscore(self._key('online'), user_id)
+        pipe.hget(self._key('room'), user_id)
+        pipe.hget(self._key('last_seen'), user_id)
+        score, room, last_seen = pipe.execute()
+        if last_seen is None:
+            return None
+        return {
+            'is_online': score is not None and score > time.time(),
+            'current_room': room or None,
+            'last_seen': float(last_seen),
+        }
+
+    def online_user_ids(self):
+        members = self.client.zrangebyscore(self._key('online'), time.time(), '+inf')
+        return [int(user_id) for user_id in members]
+
+    def filter_online(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        now = time.time()
+        scores = self.client.zmscore(self._key('online'), user_ids)
+        return {user_id for user_id, score in zip(user_ids, scores) if score is not None and score > now}
+
+    def expire(self):
+        now = time.time()
+        online_key = self._key('online')
+        expired = self.client.zrangebyscore(online_key, '-inf', now)
+        offline = []
+        for user_id in expired:
+            # Only the node whose ZREM succeeds reports the transition
+            if self.client.zrem(online_key, user_id):
+                self.client.hdel(self._key('room'), user_id)
+                offline.append(int(user_id))
+        return offline
+
+
+class PresenceTracker:
+    """Front end to the presence backend used by consumers and views.
+
+    State changes are queued and written to ``UserPresence`` in the background,
+    coalesced per user, at most once per ``flush_interval`` seconds. A sweeper
+    task on each event loop expires connections whose heartbeats stopped.
+    """
+
+    def __init__(self, backend, ttl=60, flush_interval=1.0):
+        self.backend = backend
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._timer = None
+        self._sweepers = weakref.WeakKeyDictionary()
+
+    async def _call(self, func, *args):
+        if self.backend.blocking:
+            return await sync_to_async(func, thread_sensitive=False)(*args)
+        return func(*args)
+
+    async def connect(self, user_id, channel_name, room):
+        self._ensure_sweeper()
+        await self._call(self.backend.connect, user_id, channel_name, room, time.time() + self.ttl)
+        self._queue(user_id, True, room)
+
+    async def heartbeat(self, user_id, channel_name, room):
+        became_online = await self._call(self.backend.heartbeat, user_id, channel_name, time.time() + self.ttl)
+        if became_online:
+            self._queue(user_id, True, room)
+
+    async def disconnect(self, user_id, channel_name):
+        went_offline = await self._call(self.backend.disconnect, user_id, channel_name)
+        if went_offline:
+            self._queue(user_id, False, None)
+
+    def get(self, user_id):
+        state = self.backend.get(user_id)
+        if state is not None:
+            state['last_seen'] = datetime.fromtimestamp(state['last_seen'], tz=timezone.utc)
+        return state
+
+    def online_user_ids(self):
+        return self.backend.online_user_ids()
+
+    def filter_online(self, user_ids):
+        return self.backend.filter_online(user_ids)
+
+    def _ensure_sweeper(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._sweepers:
+            self._sweepers[loop] = loop.create_task(self._sweep())
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                for user_id in await self._call(self.backend.expire):
+                    self._queue(user_id, False, None)
+            except Exception as e:
+                logger.error(f"Error expiring presence entries: {str(e)}")
+
+    def _queue(self, user_id, is_online, current_room):
+        self._pending[user_id] = (is_online, current_room)
+        if self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.flush_interval, lambda: asyncio.ensure_future(self.flush()))
+
+    async def flush(self):
+        """Write queued presence changes to the database"""
+        self._timer = None
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            await self._write(pending)
+            logger.debug(f"Wrote presence for {len(pending)} users")
+        except Exception as e:
+            logger.error(f"Error writing user presence: {str(e)}")
+
+    @database_sync_to_async
+    def _write(self, pending):
+        UserPresence.objects.bulk_create(
+            [
+                UserPresence(user_id=user_id, is_online=is_online, current_room=current_room)
+                for user_id, (is_online, current_room) in pending.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['is_online', 'current_room', 'last_seen'],
+        )
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_presence_tracker():
+    """Return the process-wide tracker built from the CHAT_PRESENCE_* settings"""
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                backend_class = import_string(
+                    getattr(settings, 'CHAT_PRESENCE_BACKEND', 'chat.presence.InMemoryPresenceBackend')
+                )
+                _tracker = PresenceTracker(
+                    backend_class(**getattr(settings, 'CHAT_PRESENCE_OPTIONS', {})),
+                    ttl=getattr(settings, 'CHAT_PRESENCE_TTL', 60),
+                    flush_interval=getattr(settings, 'CHAT_PRESENCE_FLUSH_INTERVAL', 1.0)
+                )
+    return _tracker
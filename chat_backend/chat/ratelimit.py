@@ -0,0 +1,198 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+# Default (tokens per second, burst) per scope; None disables a scope. The
+# batch scope is a per-user budget of operations sent in batch frames.
+DEFAULT_RATE_LIMITS = {
+    'connection': (5, 10),
+    'user': (10, 20),
+    'room': (100, 200),
+    'batch': (50, 100),
+}
+
+
+class BaseRateLimitBackend:
+    """Token buckets keyed by string.
+
+    ``consume`` takes ``cost`` tokens from every bucket in ``limits``, a list
+    of ``(key, rate, burst, cost)``, only if all of them hold enough; a frame
+    refused by one bucket is not charged to the others. It returns 0 when the
+    tokens were taken, otherwise the seconds until they would be available. A
+    cost larger than a bucket's burst can never be paid; callers refuse such
+    frames up front (see ``RateLimiter.max_operations``).
+    """
+
+    # Whether calls do network I/O and must run off the event loop
+    blocking = False
+
+    def consume(self, limits):
+        raise NotImplementedError
+
+
+class InMemoryRateLimitBackend(BaseRateLimitBackend):
+    """Process-local buckets for single-node deployments.
+
+    At most ``max_buckets`` are kept; the least recently used bucket is
+    dropped first, which only ever refills it early.
+    """
+
+    def __init__(self, max_buckets=100000, **options):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def consume(self, limits):
+        now = time.monotonic()
+        with self._lock:
+            refilled = []
+            wait = 0.0
+            for key, rate, burst, cost in limits:
+                tokens, updated = self._buckets.get(key, (burst, now))
+                tokens = min(burst, tokens + (now - updated) * rate)
+                if tokens < cost:
+                    wait = max(wait, (cost - tokens) / rate)
+                refilled.append((key, tokens - cost))
+            if wait:
+                return wait
+
+            for key, tokens in refilled:
+                self._buckets[key] = (tokens, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+            return 0.0
+
+
+# KEYS: bucket keys; ARGV: now, then rate, burst and cost for each key
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local wait = 0
+local remaining = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[3 * i - 1])
+    local burst = tonumber(ARGV[3 * i])
+    local cost = tonumber(ARGV[3 * i + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or burst
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+    if tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+    remaining[i] = tokens - cost
+end
+if wait == 0 then
+    for i, key in ipairs(KEYS) do
+        local rate = tonumber(ARGV[3 * i - 1])
+        local burst = tonumber(ARGV[3 * i])
+        redis.call('HSET', key, 'tokens', remaining[i], 'updated', now)
+        redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000) + 1000)
+    end
+end
+return tostring(wait)
+"""
+
+
+class RedisRateLimitBackend(BaseRateLimitBackend):
+    """Buckets shared by every node through Redis.
+
+    All buckets of a frame are checked and charged in one Lua script, so the
+    check is atomic across nodes and costs one round trip. Each bucket is a
+    hash under ``prefix`` that expires once it would have refilled.
+    """
+    blocking = True
+
+    def __init__(self, url='redis://127.0.0.1:6379', prefix='ratelimit:', client=None, **options):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImproperlyConfigured('RedisRateLimitBackend requires the redis package')
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def consume(self, limits):
+        keys = [self.prefix + key for key, _, _, _ in limits]
+        args = [time.time()]
+        for _, rate, burst, cost in limits:
+            args.extend((rate, burst, cost))
+        return float(self._script(keys=keys, args=args))
+
+
+class RateLimiter:
+    """Per-connection, per-user and per-room limits on inbound frames.
+
+    Every frame costs one token per connection and per user. Each chat
+    operation costs a room token, and operations sent in a batch frame also
+    draw on the user's batch budget, so batching trades frames for operations
+    without getting past the room's rate.
+    """
+
+    def __init__(self, backend, limits=None):
+        self.backend = backend
+        self.limits = {**DEFAULT_RATE_LIMITS, **(limits or {})}
+
+    @property
+    def max_operations(self):
+        """Most operations a batch frame can pay for, or None if unlimited"""
+        bursts = [self.limits[scope][1] for scope in ('room', 'batch') if self.limits.get(scope)]
+        return min(bursts) if bursts else None
+
+    async def check(self, channel_name, user_id, room, operations=None):
+        """Take the tokens for a frame; returns 0 or seconds to retry after.
+
+        ``operations`` is the number of operations of a batch frame, None for
+        any other frame.
+        """
+        keys = {'connection': channel_name, 'user': user_id, 'room': room, 'batch': user_id}
+        costs = {'connection': 1, 'user': 1, 'room': operations or 1}
+        if operations is not None:
+            costs['batch'] = operations
+        limits = [
+            (f'{scope}:{keys[scope]}', *self.limits[scope], cost)
+            for scope, cost in costs.items()
+            if self.limits.get(scope)
+        ]
+        if not limits:
+            return 0.0
+        if self.backend.blocking:
+            return await sync_to_async(self.backend.consume, thread_sensitive=False)(limits)
+        return self.backend.consume(limits)
+
+
+def retry_after_hint(wait):
+    """Round a wait up to whole milliseconds for the error frame"""
+    return math.ceil(wait * 1000) / 1000
+
+
+def rate_limits_enabled():
+    return getattr(settings, 'CHAT_RATE_LIMIT_ENABLED', True)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return the process-wide limiter built from the CHAT_RATE_LIMIT_* settings"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                backend_class = import_string(
+                    getattr(settings, 'CHAT_RATE_LIMIT_BACKEND', 'chat.ratelimit.InMemoryRateLimitBackend')
+                )
+                _limiter = RateLimiter(
+                    backend_class(**getattr(settings, 'CHAT_RATE_LIMIT_OPTIONS', {})),
+                    limits=getattr(settings, 'CHAT_RATE_LIMITS', None)
+                )
+    return _limiter
@@ -0,0 +1,99 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import ChatMessage
+
+# SQLite FTS5 table indexing ChatMessage.message, keyed by message id. It keeps
+# its own copy of the text so rows can be removed by id alone.
+FTS_TABLE = 'chat_message_fts'
+
+
+def search_config():
+    """Postgres text search configuration used for indexing and queries"""
+    return getattr(settings, 'CHAT_SEARCH_CONFIG', 'simple')
+
+
+def index_messages(chat_messages):
+    """Add saved messages to the full-text index.
+
+    Call from the write path, inside the transaction that stored them.
+    """
+    rows = [(chat_message.id, chat_message.message) for chat_message in chat_messages if chat_message.message]
+    if not rows:
+        return
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.executemany(f'INSERT INTO {FTS_TABLE}(rowid, message) VALUES (%s, %s)', rows)
+    elif connection.vendor == 'postgresql':
+        ChatMessage.objects.filter(id__in=[message_id for message_id, _ in rows]).update(
+            search_vector=SearchVector('message', config=search_config())
+        )
+
+
+def unindex_messages(chat_messages):
+    """Drop messages from the FTS5 table; Postgres drops them with the rows"""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                [(chat_message.id,) for chat_message in chat_messages]
+            )
+
+
+@receiver(post_delete, sender=ChatMessage)
+def remove_from_index(sender, instance, **kwargs):
+    unindex_messages([instance])
+
+
+def rebuild_index(batch_size=5000):
+    """Rebuild the index from ``ChatMessage``; returns the number of messages indexed"""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE}(rowid, message) '
+                f'SELECT id, message FROM chat_chatmessage WHERE message IS NOT NULL'
+            )
+            return cursor.rowcount
+
+    if connection.vendor != 'postgresql':
+        return 0
+    indexed = 0
+    last_id = 0
+    while True:
+        ids = list(
+            ChatMessage.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return indexed
+        indexed += ChatMessage.objects.filter(id__in=ids).update(
+            search_vector=SearchVector('message', config=search_config())
+        )
+        last_id = ids[-1]
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query matching every term, immune to FTS5 syntax"""
+    terms = ['"%s"' % term.replace('"', '""') for term in text.split()]
+    return ' '.join(terms)
+
+
+def search_messages(queryset, text):
+    """Filter ``queryset`` to messages matching ``text`` and annotate a ``rank``.
+
+    Higher ranks are better matches on every backend.
+    """
+    if connection.vendor == 'sqlite':
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = chat_chatmessage.id', f'{FTS_TABLE} MATCH %s'],
+            params=[fts_query(text)]
+        ).annotate(rank=RawSQL(f'-bm25({FTS_TABLE})', ()))
+
+    query = SearchQuery(text, config=search_config(), search_type='websearch')
+    return queryset.filter(search_vector=query).annotate(rank=SearchRank(F('search_vector'), query))
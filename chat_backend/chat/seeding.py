@@ -0,0 +1,177 @@
+"""Synthetic datasets for benchmarking.
+
+Seeded users and rooms are named with a prefix so a dataset can be removed
+again without touching real data. Messages and notifications are spread over
+a time window with ids increasing with time, and message traffic is skewed
+towards a few busy rooms the way real chat traffic is.
+"""
+import itertools
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import ArchiveSegment, ChatMessage, ChatRoom, Notification, NotificationCounter, UserPresence, UserRoom
+from .search import FTS_TABLE, index_messages
+
+DEFAULT_PREFIX = 'bench_'
+
+# Dataset sizes; ``large`` is the production-scale target
+TIERS = {
+    'small': {'users': 100, 'rooms': 10, 'messages': 10_000, 'notifications': 10_000},
+    'medium': {'users': 1_000, 'rooms': 100, 'messages': 100_000, 'notifications': 100_000},
+    'large': {'users': 10_000, 'rooms': 1_000, 'messages': 1_000_000, 'notifications': 1_000_000},
+}
+
+WORDS = (
+    'the a and to of in is it you that for on was with he as have be at one this from by hot '
+    'word but what some we can out other were all there when up use your how said an each she '
+    'meeting deploy release review lunch tomorrow today thanks sounds good build broken fixed '
+    'ticket merge branch staging production coffee weekend call later question answer update'
+).split()
+
+NOTIFICATION_TYPES = ['message', 'mention', 'reaction', 'system']
+
+
+@contextmanager
+def explicit_timestamps(model, field_name):
+    """Let ``bulk_create`` store the given values of an ``auto_now_add`` field"""
+    field = model._meta.get_field(field_name)
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def spread(start, span, index, total):
+    return start + span * (index / total)
+
+
+def random_text(rng):
+    return ' '.join(rng.choices(WORDS, k=rng.randint(3, 20)))
+
+
+def seed_dataset(users, rooms, messages, notifications, members_per_room=20, days=90, unread_fraction=0.3,
+                 prefix=DEFAULT_PREFIX, batch_size=5000, seed=0, progress=None):
+    """Create a synthetic dataset and return the number of rows created per model.
+
+    ``progress`` is called with ``(model_name, created, total)`` after every batch.
+    """
+    rng = random.Random(seed)
+    report = progress or (lambda name, created, total: None)
+    end = timezone.now()
+    start = end - timedelta(days=days)
+    span = end - start
+
+    password = make_password(None)
+    user_ids = []
+    for offset in range(0, users, batch_size):
+        created = User.objects.bulk_create([
+            User(username=f'{prefix}user_{index}', password=password)
+            for index in range(offset, min(offset + batch_size, users))
+        ])
+        user_ids.extend(user.id for user in created)
+        report('users', len(user_ids), users)
+
+    room_ids = [
+        room.id for room in ChatRoom.objects.bulk_create(
+            [ChatRoom(name=f'{prefix}room_{index}') for index in range(rooms)], batch_size=batch_size
+        )
+    ]
+    report('rooms', len(room_ids), rooms)
+
+    members = {}
+    memberships = []
+    for room_id in room_ids:
+        members[room_id] = rng.sample(user_ids, min(members_per_room, len(user_ids)))
+        memberships.extend(UserRoom(user_id=user_id, room_id=room_id) for user_id in members[room_id])
+    UserRoom.objects.bulk_create(memberships, batch_size=batch_size)
+    report('memberships', len(memberships), len(memberships))
+
+    # Room popularity falls off as 1/rank
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(room_ids) + 1)))
+    message_ids = []
+    with explicit_timestamps(ChatMessage, 'timestamp'):
+        for offset in range(0, messages, batch_size):
+            batch = []
+            for index in range(offset, min(offset + batch_size, messages)):
+                room_id = rng.choices(room_ids, cum_weights=cum_weights)[0]
+                batch.append(ChatMessage(
+                    room_id=room_id,
+                    user_id=rng.choice(members[room_id]),
+                    message=random_text(rng),
+                    timestamp=spread(start, span, index, messages),
+                ))
+            with transaction.atomic():
+                created = ChatMessage.objects.bulk_create(batch)
+                index_messages(created)
+            message_ids.extend(chat_message.id for chat_message in created)
+            report('messages', len(message_ids), messages)
+
+    created_notifications = 0
+    with explicit_timestamps(Notification, 'created_at'):
+        for offset in range(0, notifications, batch_size):
+            batch = []
+            for index in range(offset, min(offset + batch_size, notifications)):
+                notification_type = rng.choice(NOTIFICATION_TYPES)
+                batch.append(Notification(
+                    recipient_id=rng.choice(user_ids),
+                    sender_id=rng.choice(user_ids),
+                    notification_type=notification_type,
+                    title=f'New {notification_type}',
+                    message=random_text(rng),
+                    is_read=rng.random() >= unread_fraction,
+                    related_message_id=rng.choice(message_ids) if message_ids and notification_type != 'system' else None,
+                    room_name=f'{prefix}room_{rng.randrange(rooms)}' if rooms else None,
+                    created_at=spread(start, span, index, notifications),
+                ))
+            with transaction.atomic():
+                Notification.objects.bulk_create(batch)
+                NotificationCounter.increment(batch)
+            created_notifications += len(batch)
+            report('notifications', created_notifications, notifications)
+
+    return {
+        'users': len(user_ids),
+        'rooms': len(room_ids),
+        'memberships': len(memberships),
+        'messages': len(message_ids),
+        'notifications': created_notifications,
+    }
+
+
+def clear_dataset(prefix=DEFAULT_PREFIX):
+    """Delete every seeded user and room and everything that belongs to them.
+
+    Messages and notifications are deleted in bulk, skipping the per-row
+    ``post_delete`` handlers: seeded messages have no attachments, and their
+    search index entries are dropped with one statement. Returns the number of
+    users and rooms deleted.
+    """
+    users = User.objects.filter(username__startswith=prefix)
+    rooms = ChatRoom.objects.filter(name__startswith=prefix)
+
+    with transaction.atomic():
+        notifications = Notification.objects.filter(recipient__in=users)
+        notifications._raw_delete(notifications.db)
+        messages = ChatMessage.objects.filter(room__in=rooms)
+        if connection.vendor == 'sqlite':
+            sql, params = messages.order_by().values('id').query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({sql})', params)
+        messages._raw_delete(messages.db)
+        for model in (NotificationCounter, UserPresence, UserRoom):
+            related = model.objects.filter(user__in=users)
+            related._raw_delete(related.db)
+
+    # Segment files are removed by ArchiveSegment's post_delete handler
+    ArchiveSegment.objects.filter(room__in=rooms).delete()
+    deleted = {'users': users.count(), 'rooms': rooms.count()}
+    rooms.delete()
+    users.delete()
+    return deleted
@@ -2,7 +2,9 @@ from rest_framework import serializers
 from django.contrib.auth.models import User
 from rest_framework.validators import UniqueValidator
 from django.contrib.auth.password_validation import validate_password
+from django.utils.encoding import filepath_to_uri
 from .models import ChatRoom, ChatMessage, UserRoom, Notification, UserPresence
+from .thumbnails import thumbnail_urls
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -113,6 +115,31 @@ class ChatMessageSerializer(serializers.ModelSerializer):
         return message
 
 
+class ChatMessageHistorySerializer(serializers.ModelSerializer):
+    """Read-only serializer for message history pages.
+
+    Expects messages annotated with ``username`` and a ``file_base_url`` in the
+    context, so a page is rendered without per-row queries or URL building.
+    """
+    username = serializers.CharField(read_only=True)
+    file_url = serializers.SerializerMethodField()
+    thumbnails = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ChatMessage
+        fields = ['id', 'room', 'user', 'username', 'message', 'message_type', 'file_url', 'file_name', 'file_size', 'mime_type', 'thumbnails', 'timestamp']
+        read_only_fields = fields
+
+    def get_file_url(self, obj):
+        """Join the stored file name onto the precomputed media base URL"""
+        if obj.file:
+            return self.context['file_base_url'] + filepath_to_uri(obj.file.name)
+        return None
+
+    def get_thumbnails(self, obj):
+        return thumbnail_urls(obj.thumbnails, self.context['file_base_url'])
+
+
 class UserRoomSerializer(serializers.ModelSerializer):
     username = serializers.CharField(source='user.username', read_only=True)
     room_name = serializers.CharField(source='room.name', read_only=True)
@@ -124,7 +151,8 @@ class UserRoomSerializer(serializers.ModelSerializer):
 
 
 class NotificationSerializer(serializers.ModelSerializer):
-    sender_username = serializers.CharField(source='sender.username', read_only=True)
+    # None once the sender's account is deleted
+    sender_username = serializers.CharField(source='sender.username', read_only=True, default=None)
     
     class Meta:
         model = Notification
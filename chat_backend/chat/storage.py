@@ -0,0 +1,105 @@
+import hashlib
+import os
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.utils import timezone
+
+from .media import media_url
+from .models import Attachment, AttachmentUpload, CONTENT_ADDRESSED_PREFIX
+
+
+def temporary_upload_path():
+    """Return a fresh path for an upload that has not been hashed yet"""
+    upload_dir = os.path.join(settings.MEDIA_ROOT, 'chat_uploads')
+    os.makedirs(upload_dir, exist_ok=True)
+    return os.path.join(upload_dir, f'{uuid.uuid4()}.part')
+
+
+def write_hashed(chunks, path):
+    """Write chunks to ``path`` while hashing them; returns ``(sha256, size)``"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'wb') as destination:
+        for chunk in chunks:
+            digest.update(chunk)
+            destination.write(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_path(sha256, file_name):
+    """Storage name of a blob: ``chat_files/sha256/ab/cd/<sha256><ext>``"""
+    extension = os.path.splitext(file_name)[1].lower()
+    return f'{CONTENT_ADDRESSED_PREFIX}{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}'
+
+
+def store_attachment(temp_path, sha256, size, file_name, mime_type):
+    """Move a hashed upload into content-addressed storage.
+
+    When a blob with the same hash already exists the temporary file is
+    discarded and the existing ``Attachment`` is returned.
+    """
+    existing = Attachment.objects.filter(sha256=sha256).first()
+    if existing is not None:
+        os.remove(temp_path)
+        return existing
+
+    name = content_path(sha256, file_name)
+    final_path = os.path.join(settings.MEDIA_ROOT, name)
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    os.replace(temp_path, final_path)
+    try:
+        return Attachment.objects.create(sha256=sha256, file=name, size=size, mime_type=mime_type)
+    except IntegrityError:
+        # Another request stored the same content first; both wrote identical bytes
+        return Attachment.objects.get(sha256=sha256)
+
+
+def record_upload(attachment, user):
+    """Note that ``user`` sent the attachment's bytes, so they may reference it by hash"""
+    AttachmentUpload.objects.update_or_create(
+        attachment=attachment, user=user, defaults={'uploaded_at': timezone.now()}
+    )
+
+
+def collect_unused_attachments(grace_seconds, dry_run=False):
+    """Delete blobs no message references whose latest upload is older than ``grace_seconds``.
+
+    Returns the number of attachments deleted, or that would be.
+    """
+    cutoff = timezone.now() - timedelta(seconds=grace_seconds)
+    unused = Attachment.objects.filter(ref_count=0, created_at__lt=cutoff).exclude(
+        uploads__uploaded_at__gte=cutoff
+    )
+    if dry_run:
+        return unused.count()
+    collected = 0
+    for attachment in unused.iterator():
+        # Only if no message linked it since it was selected
+        deleted, _ = Attachment.objects.filter(id=attachment.id, ref_count=0).delete()
+        if deleted:
+            attachment.file.delete(save=False)
+            collected += 1
+    return collected
+
+
+def attachment_file_info(attachment, file_name, mime_type=None):
+    """File information returned to clients and sent back in ``file_info``"""
+    return {
+        'file_name': file_name,
+        'file_size': attachment.size,
+        'mime_type': mime_type or attachment.mime_type,
+        'file_url': media_url(attachment.file.name),
+        'sha256': attachment.sha256,
+    }
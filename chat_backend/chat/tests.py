@@ -0,0 +1,221 @@
+import json
+import os
+import shutil
+import tempfile
+
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.db.models import F
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import codecs
+from .archive import archive_room_month
+from .history import RecentHistory
+from .models import ChatMessage, ChatRoom, UserRoom
+from chat_backend.asgi import application
+
+
+class ChatRoomMessagesQueryCountTests(APITestCase):
+    """A history page costs the same number of queries whatever its size"""
+    message_count = 45
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(username=f'history_user_{index}') for index in range(3)]
+        cls.room = ChatRoom.objects.create(name='history-room')
+        for index in range(cls.message_count):
+            if index % 5 == 0:
+                ChatMessage.objects.create(
+                    room=cls.room, user=cls.users[index % 3], message_type='file',
+                    file=f'chat_files/{index}.txt', file_name=f'{index}.txt', file_size=index, mime_type='text/plain'
+                )
+            else:
+                ChatMessage.objects.create(room=cls.room, user=cls.users[index % 3], message=f'message {index}')
+
+    def setUp(self):
+        self.client.force_authenticate(self.users[0])
+        self.url = reverse('chat:room-messages', kwargs={'room_id': self.room.id})
+
+    def test_older_pages(self):
+        # Walking back from the newest page: one query per page while hot
+        # messages remain, plus the archive lookup on the oldest page
+        for page_size in (5, 20, 50):
+            with self.subTest(page_size=page_size):
+                url = f'{self.url}?page_size={page_size}'
+                seen = []
+                while url:
+                    last_page = len(seen) + page_size >= self.message_count
+                    with self.assertNumQueries(2 if last_page else 1):
+                        response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    seen[:0] = [message['id'] for message in response.data['results']]
+                    url = response.data['previous']
+                self.assertEqual(seen, list(ChatMessage.objects.filter(room=self.room).order_by('timestamp', 'id').values_list('id', flat=True)))
+
+    def test_newer_pages(self):
+        # Pages after a cursor always check the archive first
+        oldest = self.client.get(f'{self.url}?page_size=1').data
+        while oldest['previous']:
+            oldest = self.client.get(oldest['previous']).data
+        for page_size in (5, 20):
+            with self.subTest(page_size=page_size):
+                url = oldest['next'].replace('page_size=1', f'page_size={page_size}')
+                pages = 0
+                while url:
+                    with self.assertNumQueries(2):
+                        response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    pages += 1
+                    url = response.data['next']
+                self.assertEqual(pages, -(-(self.message_count - 1) // page_size))
+
+    def test_rows_render_without_extra_queries(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(f'{self.url}?page_size=10')
+        results = response.data['results']
+        self.assertEqual({message['username'] for message in results}, {user.username for user in self.users})
+        file_messages = [message for message in results if message['message_type'] == 'file']
+        self.assertTrue(file_messages)
+        self.assertTrue(all(message['file_url'].startswith('http://testserver/') for message in file_messages))
+
+
+class MediaAccessTests(APITestCase):
+    """Stored files are only served to members of a room holding them"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.settings_override = override_settings(
+            MEDIA_ROOT=cls.media_root, CHAT_ARCHIVE_ROOT=os.path.join(cls.media_root, 'archive')
+        )
+        cls.settings_override.enable()
+        for name in ('chat_files/sha256/abc.png', 'chat_thumbnails/sha256/abc_256.jpg',
+                     'chat_files/sha256/unsent.png', 'chat_thumbnails/sha256/abc.def_256.jpg'):
+            path = os.path.join(cls.media_root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as stored:
+                stored.write(b'stored bytes')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        shutil.rmtree(cls.media_root)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = User.objects.create_user(username='media_member')
+        cls.outsider = User.objects.create_user(username='media_outsider')
+        cls.room = room = ChatRoom.objects.create(name='media-room')
+        UserRoom.objects.create(user=cls.member, room=room)
+        ChatMessage.objects.create(
+            room=room, user=cls.member, message_type='image', file='chat_files/sha256/abc.png', file_name='abc.png'
+        )
+
+    def fetch(self, user, name):
+        self.client.force_authenticate(user)
+        return self.client.get(reverse('chat:media', kwargs={'name': name}))
+
+    def test_member_gets_attachment_and_thumbnail(self):
+        self.assertEqual(self.fetch(self.member, 'chat_files/sha256/abc.png').status_code, 200)
+        self.assertEqual(self.fetch(self.member, 'chat_thumbnails/sha256/abc_256.jpg').status_code, 200)
+
+    def test_outsider_is_refused(self):
+        self.assertEqual(self.fetch(self.outsider, 'chat_files/sha256/abc.png').status_code, 404)
+        self.assertEqual(self.fetch(self.outsider, 'chat_thumbnails/sha256/abc_256.jpg').status_code, 404)
+
+    def test_files_without_a_message_are_refused(self):
+        self.assertEqual(self.fetch(self.member, 'chat_files/sha256/unsent.png').status_code, 404)
+        # Shares a prefix with abc.png but belongs to another original
+        self.assertEqual(self.fetch(self.member, 'chat_thumbnails/sha256/abc.def_256.jpg').status_code, 404)
+
+    def test_archived_messages_keep_their_files(self):
+        messages = list(ChatMessage.objects.filter(room=self.room).annotate(username=F('user__username')))
+        archive_room_month(self.room.id, messages[0].timestamp.date().replace(day=1), messages)
+        self.assertFalse(ChatMessage.objects.filter(room=self.room).exists())
+        self.assertEqual(self.fetch(self.member, 'chat_files/sha256/abc.png').status_code, 200)
+        self.assertEqual(self.fetch(self.member, 'chat_thumbnails/sha256/abc_256.jpg').status_code, 200)
+        self.assertEqual(self.fetch(self.outsider, 'chat_files/sha256/abc.png').status_code, 404)
+
+
+class RecentHistoryTests(SimpleTestCase):
+    """Buffers only hold what the room's live connections have seen"""
+
+    def broadcast(self, *message_ids):
+        messages = [{'type': 'chat_message', 'message_id': message_id} for message_id in message_ids]
+        data = messages[0] if len(messages) == 1 else {'type': 'chat_messages', 'messages': messages}
+        return {'type': 'chat_message', 'message_ids': list(message_ids), **codecs.encode_broadcast(data)}
+
+    def ids(self, history):
+        return [message['message_id'] for message in history.get('room')]
+
+    def test_broadcasts_during_load_are_kept(self):
+        history = RecentHistory(size=3)
+        history.attach('room')
+        token = history.begin_load('room')
+        history.record('room', self.broadcast(2, 3))
+        history.load('room', [{'message_id': 1}, {'message_id': 2}], token)
+        self.assertEqual(self.ids(history), [1, 2, 3])
+        history.record('room', self.broadcast(4))
+        self.assertEqual(self.ids(history), [2, 3, 4])
+
+    def test_last_connection_drops_the_buffer(self):
+        history = RecentHistory()
+        history.attach('room')
+        history.attach('room')
+        history.load('room', [{'message_id': 1}], history.begin_load('room'))
+        history.detach('room')
+        self.assertEqual(self.ids(history), [1])
+        history.detach('room')
+        self.assertIsNone(history.get('room'))
+
+    def test_stale_loads_are_not_installed(self):
+        history = RecentHistory()
+        history.attach('room')
+        token = history.begin_load('room')
+        history.evict('room')
+        history.load('room', [{'message_id': 1}], token)
+        self.assertIsNone(history.get('room'))
+
+        # Nothing in the process would keep it up to date
+        history.detach('room')
+        history.load('room', [{'message_id': 1}], history.begin_load('room'))
+        self.assertIsNone(history.get('room'))
+
+
+class BatchFrameTests(TransactionTestCase):
+    """Invalid operations of a batch are reported without failing the rest"""
+
+    async def test_mixed_batch(self):
+        user = await sync_to_async(User.objects.create_user)(username='batch_user')
+        communicator = WebsocketCommunicator(
+            application, '/ws/chat/batch-room/',
+            headers=[(b'authorization', f'Bearer {AccessToken.for_user(user)}'.encode())]
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()  # connection
+        await communicator.receive_json_from()  # history
+
+        await communicator.send_json_to([
+            {'message': 'first'},
+            {'message_type': 'file', 'file_info': {'file_name': 'a.txt', 'file_size': 'abc'}},
+            {'message_type': 'file', 'file_info': {'file_name': 'b.txt', 'file_size': 3, 'mime_type': 'text/plain'}},
+            {'message': ''},
+        ])
+        result = await communicator.receive_json_from()
+        broadcast = await communicator.receive_json_from()
+        await communicator.disconnect()
+
+        self.assertEqual(broadcast['type'], 'chat_messages')
+        self.assertEqual([message['message_type'] for message in broadcast['messages']], ['text', 'file'])
+        self.assertEqual(result['type'], 'batch_result')
+        self.assertEqual([item['status'] for item in result['results']], ['ok', 'error', 'ok', 'error'])
+        self.assertEqual(result['results'][1]['message'], 'File size must be a non-negative integer')
+        saved = await sync_to_async(list)(ChatMessage.objects.order_by('id').values_list('id', flat=True))
+        self.assertEqual(saved, [result['results'][0]['message_id'], result['results'][2]['message_id']])
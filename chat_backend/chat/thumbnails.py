@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils.encoding import filepath_to_uri
+
+from . import codecs, imaging, metrics
+from .media import media_url
+from .metrics import database_sync_to_async
+from .models import ChatMessage
+
+logger = logging.getLogger('chat.websocket')
+
+# Message types that get thumbnails; videos are thumbnailed from a poster frame
+THUMBNAIL_TYPES = {'image', 'video'}
+
+
+def thumbnail_name(file_name, size):
+    """Storage name of a thumbnail, mirroring the original under ``chat_thumbnails/``"""
+    stem = os.path.splitext(file_name)[0]
+    if stem.startswith('chat_files/'):
+        stem = stem[len('chat_files/'):]
+    return f'chat_thumbnails/{stem}_{size}.jpg'
+
+
+def thumbnail_urls(thumbnails, base_url=None):
+    """Map the stored ``{size: name}`` of a message to ``{size: url}``"""
+    if base_url is None:
+        return {size: media_url(name) for size, name in thumbnails.items()}
+    return {size: base_url + filepath_to_uri(name) for size, name in thumbnails.items()}
+
+
+class ThumbnailPipeline:
+    """Renders thumbnails of image and video messages off the request path.
+
+    Rendering runs in a process pool so decoding large images never blocks an
+    event loop or holds the GIL of a worker serving sockets. When a message's
+    thumbnails are ready they are stored on the message and a
+    ``chat_thumbnails`` frame is broadcast to its room.
+    """
+
+    def __init__(self, sizes=(160, 480), max_workers=2):
+        self.sizes = sorted(sizes)
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._tasks = set()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # Forking a process running threads and event loops is unsafe
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+        return self._executor
+
+    def schedule(self, room_group_name, chat_messages):
+        """Start rendering thumbnails for any eligible messages in the background"""
+        eligible = [
+            chat_message for chat_message in chat_messages
+            if chat_message.file and chat_message.message_type in THUMBNAIL_TYPES
+        ]
+        if not eligible:
+            return
+        task = asyncio.get_running_loop().create_task(self.process(room_group_name, eligible))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def process(self, room_group_name, chat_messages):
+        loop = asyncio.get_running_loop()
+        channel_layer = get_channel_layer()
+        for chat_message in chat_messages:
+            try:
+                file_name = chat_message.file.name
+                targets = [
+                    (size, os.path.join(settings.MEDIA_ROOT, thumbnail_name(file_name, size)))
+                    for size in self.sizes
+                ]
+                rendered = await loop.run_in_executor(
+                    self.executor,
+                    imaging.render_thumbnails,
+                    os.path.join(settings.MEDIA_ROOT, file_name),
+                    targets,
+                    chat_message.message_type == 'video'
+                )
+                if not rendered:
+                    continue
+
+                thumbnails = {str(size): thumbnail_name(file_name, size) for size in rendered}
+                await self._record(chat_message.id, thumbnails)
+
+                urls = thumbnail_urls(thumbnails)
+                with metrics.group_send_seconds.time():
+                    await channel_layer.group_send(
+                        room_group_name,
+                        {
+                            'type': 'chat_thumbnails',
+                            'message_id': chat_message.id,
+                            'thumbnails': urls,
+                            **codecs.encode_broadcast({
+                                'type': 'chat_thumbnails',
+                                'message_id': chat_message.id,
+                                'thumbnails': urls
+                            })
+                        }
+                    )
+                logger.debug(f"Rendered {len(rendered)} thumbnails for message {chat_message.id}")
+            except Exception as e:
+                logger.error(f"Error rendering thumbnails for message {chat_message.id}: {str(e)}")
+
+    @database_sync_to_async
+    def _record(self, message_id, thumbnails):
+        ChatMessage.objects.filter(id=message_id).update(thumbnails=thumbnails)
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def thumbnails_enabled():
+    return getattr(settings, 'CHAT_THUMBNAILS_ENABLED', True) and imaging.available()
+
+
+def get_thumbnail_pipeline():
+    """Return the process-wide pipeline built from the CHAT_THUMBNAIL_* settings"""
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = ThumbnailPipeline(
+                    sizes=getattr(settings, 'CHAT_THUMBNAIL_SIZES', (160, 480)),
+                    max_workers=getattr(settings, 'CHAT_THUMBNAIL_WORKERS', 2)
+                )
+    return _pipeline
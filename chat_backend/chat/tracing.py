@@ -0,0 +1,106 @@
+"""Sampled stage timing for the message pipeline.
+
+A message picked for tracing gets a trace id when ``ChatConsumer.receive``
+starts. Stages run under it are timed with ``span``, and the id is carried in
+the ``group_send`` event, so every recipient's ``chat_message`` records its
+own spans under the same trace, in whichever process it runs. Each handler
+writes one JSON line per trace to the ``chat.trace`` logger, whose file
+handler runs on the logging listener thread. ``manage.py trace_breakdown``
+reassembles the lines.
+
+Tracing costs a context variable lookup per stage when a message is not
+sampled.
+"""
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager, nullcontext
+
+from django.conf import settings
+
+trace_logger = logging.getLogger('chat.trace')
+
+_current = contextvars.ContextVar('chat_trace', default=None)
+_no_span = nullcontext()
+
+
+def sample_rate():
+    return getattr(settings, 'CHAT_TRACE_SAMPLE_RATE', 0.0)
+
+
+class Trace:
+    """Spans recorded by one handler invocation for one trace id"""
+
+    def __init__(self, trace_id, handler, **fields):
+        self.trace_id = trace_id
+        self.handler = handler
+        self.fields = fields
+        self.spans = []
+
+    def add(self, name, started, duration):
+        self.spans.append({'name': name, 'start': round(started, 6), 'ms': round(duration * 1000, 3)})
+
+    @contextmanager
+    def span(self, name):
+        started = time.time()
+        clock = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, started, time.perf_counter() - clock)
+
+    def context(self):
+        """Trace reference carried in channel layer events"""
+        return {'id': self.trace_id, 'sent': time.time()}
+
+    def export(self):
+        trace_logger.info(json.dumps({
+            'trace': self.trace_id,
+            'handler': self.handler,
+            'pid': os.getpid(),
+            **self.fields,
+            'spans': self.spans,
+        }, separators=(',', ':')))
+
+
+@contextmanager
+def trace(handler, context=None, sample=True, **fields):
+    """Trace a handler invocation and export its spans when it returns.
+
+    Continues the trace referenced by ``context`` (from ``Trace.context``);
+    otherwise, if ``sample`` is set, starts a new one with probability
+    ``CHAT_TRACE_SAMPLE_RATE``. Yields the ``Trace``, or None when the
+    invocation is not traced.
+    """
+    if context is not None:
+        current = Trace(context['id'], handler, **fields)
+        # Time spent in the channel layer between group_send and this handler
+        current.add('transit', context['sent'], max(time.time() - context['sent'], 0))
+    elif sample and random.random() < sample_rate():
+        current = Trace(os.urandom(8).hex(), handler, **fields)
+    else:
+        yield None
+        return
+
+    token = _current.set(current)
+    try:
+        with current.span(handler):
+            yield current
+    finally:
+        _current.reset(token)
+        current.export()
+
+
+def span(name):
+    """Time a stage of the current trace; a no-op when nothing is traced"""
+    current = _current.get()
+    return current.span(name) if current is not None else _no_span
+
+
+def current_context():
+    """Trace reference to attach to an outgoing event, or None"""
+    current = _current.get()
+    return current.context() if current is not None else None
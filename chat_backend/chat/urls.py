@@ -1,9 +1,10 @@
 from django.urls import path
 from .views import (
     RegisterView, ProfileView, LogoutView, 
-    ChatRoomListCreateView, ChatRoomMessagesView, SendMessageView, JoinRoomView, LeaveRoomView,
-    get_notifications, mark_notification_read, mark_all_notifications_read, get_user_presence, get_online_users,
-    FileUploadView
+    ChatRoomListCreateView, ChatRoomMessagesView, SendMessageView, MessageSearchView, JoinRoomView, LeaveRoomView,
+    get_notifications, mark_notification_read, mark_all_notifications_read, get_unread_counts, get_user_presence, get_online_users,
+    FileUploadView, get_attachment, MediaView, ResumableUploadCreateView, ResumableUploadView, ResumableUploadCompleteView,
+    get_metrics
 )
 
 app_name = 'chat'
@@ -16,6 +17,7 @@ urlpatterns = [
     # Chat room endpoints
     path('rooms/', ChatRoomListCreateView.as_view(), name='room-list-create'),
     path('rooms/<int:room_id>/messages/', ChatRoomMessagesView.as_view(), name='room-messages'),
+    path('messages/search/', MessageSearchView.as_view(), name='message-search'),
     path('rooms/<int:room_id>/send-message/', SendMessageView.as_view(), name='send-message'),
     path('rooms/<int:room_id>/join/', JoinRoomView.as_view(), name='join-room'),
     path('rooms/<int:room_id>/leave/', LeaveRoomView.as_view(), name='leave-room'),
@@ -24,11 +26,20 @@ urlpatterns = [
     path('notifications/', get_notifications, name='get-notifications'),
     path('notifications/<int:notification_id>/mark-read/', mark_notification_read, name='mark-notification-read'),
     path('notifications/mark-all-read/', mark_all_notifications_read, name='mark-all-notifications-read'),
+    path('notifications/unread-counts/', get_unread_counts, name='get-unread-counts'),
     
     # File upload endpoint
     path('upload-file/', FileUploadView.as_view(), name='upload-file'),
+    path('attachments/<str:sha256>/', get_attachment, name='get-attachment'),
+    path('media/<path:name>', MediaView.as_view(), name='media'),
+    path('uploads/', ResumableUploadCreateView.as_view(), name='resumable-upload-create'),
+    path('uploads/<uuid:upload_id>/', ResumableUploadView.as_view(), name='resumable-upload'),
+    path('uploads/<uuid:upload_id>/complete/', ResumableUploadCompleteView.as_view(), name='resumable-upload-complete'),
     
     # User presence endpoints
     path('users/<str:username>/presence/', get_user_presence, name='get-user-presence'),
     path('users/online/', get_online_users, name='get-online-users'),
+
+    # Prometheus scrape endpoint
+    path('metrics/', get_metrics, name='metrics'),
 ]
\ No newline at end of file
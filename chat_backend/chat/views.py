@@ -1,10 +1,23 @@
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework.exceptions import ValidationError
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db.models import F
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.tokens import RefreshToken
-from .serializers import RegisterSerializer, UserSerializer, ChatRoomSerializer, ChatMessageSerializer, UserRoomSerializer, NotificationSerializer, UserPresenceSerializer
-from .models import ChatRoom, ChatMessage, UserRoom, Notification, UserPresence
+from .serializers import RegisterSerializer, UserSerializer, ChatRoomSerializer, ChatMessageSerializer, ChatMessageHistorySerializer, UserRoomSerializer, NotificationSerializer, UserPresenceSerializer
+from .authentication import QueryParamJWTAuthentication
+from .models import ChatRoom, ChatMessage, UserRoom, Notification, UserPresence, NotificationCounter, ChunkedUpload, Attachment, AttachmentUpload, upload_expiry
+from .pagination import HistoryPagination, FeedPagination, SearchPagination
+from .cache import room_cache
+from .presence import get_presence_tracker
+from .search import index_messages, search_messages
+from .media import can_access_media, media_url, resolve_media_path, serve_media
+from .storage import temporary_upload_path, write_hashed, hash_file, store_attachment, record_upload, attachment_file_info
+from .consumers import build_message_data
+from . import codecs, metrics
 
 
 class RegisterView(generics.CreateAPIView):
@@ -69,17 +82,30 @@ class ChatRoomListCreateView(generics.ListCreateAPIView):
 
     def perform_create(self, serializer):
         room = serializer.save()
+        room_cache.invalidate(room.name)
         # Automatically add the creator to the room
         UserRoom.objects.create(user=self.request.user, room=room)
 
 
 class ChatRoomMessagesView(generics.ListAPIView):
-    serializer_class = ChatMessageSerializer
+    serializer_class = ChatMessageHistorySerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = HistoryPagination
 
     def get_queryset(self):
+        # Ordering is applied by the paginator on (timestamp, id); usernames
+        # are joined in so a page costs a single query
         room_id = self.kwargs['room_id']
-        return ChatMessage.objects.filter(room_id=room_id).order_by('timestamp')
+        return ChatMessage.objects.filter(room_id=room_id).annotate(
+            username=F('user__username')
+        ).only(
+            'id', 'room_id', 'user_id', 'message', 'message_type', 'file', 'file_name', 'file_size', 'mime_type', 'thumbnails', 'timestamp'
+        )
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['file_base_url'] = self.request.build_absolute_uri(getattr(settings, 'CHAT_MEDIA_URL', settings.MEDIA_URL))
+        return context
 
 
 class SendMessageView(generics.CreateAPIView):
@@ -88,7 +114,65 @@ class SendMessageView(generics.CreateAPIView):
 
     def perform_create(self, serializer):
         room_id = self.kwargs['room_id']
-        serializer.save(user=self.request.user, room_id=room_id)
+        with transaction.atomic():
+            chat_message = serializer.save(user=self.request.user, room_id=room_id)
+            index_messages([chat_message])
+            transaction.on_commit(lambda: broadcast_message(chat_message))
+
+
+def broadcast_message(chat_message):
+    """Send a message saved over REST to the room's open WebSockets.
+
+    The event matches the one consumers send, so connected clients and the
+    recent history buffers see the message like any other.
+    """
+    try:
+        event = {
+            'type': 'chat_message',
+            'message_ids': [chat_message.id],
+            **codecs.encode_broadcast(build_message_data(chat_message, chat_message.user.username))
+        }
+        with metrics.group_send_seconds.time():
+            async_to_sync(get_channel_layer().group_send)(f'chat_{chat_message.room.name}', event)
+    except Exception as e:
+        logger.error(f'Error broadcasting message {chat_message.id}: {str(e)}')
+
+
+class MessageSearchView(generics.ListAPIView):
+    """Full-text search over messages in the rooms the user has joined.
+
+    Query parameters:
+        q: search text; every term must match
+        room: optional room id to search in
+    """
+    serializer_class = ChatMessageHistorySerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = SearchPagination
+
+    def get_queryset(self):
+        text = self.request.query_params.get('q', '').strip()
+        if not text:
+            raise ValidationError({'error': 'Search text is required'})
+
+        queryset = ChatMessage.objects.filter(
+            room_id__in=UserRoom.objects.filter(user=self.request.user).values('room_id')
+        )
+        room_id = self.request.query_params.get('room')
+        if room_id is not None:
+            if not room_id.isdigit():
+                raise ValidationError({'error': 'Invalid room'})
+            queryset = queryset.filter(room_id=room_id)
+
+        return search_messages(queryset, text).annotate(
+            username=F('user__username')
+        ).only(
+            'id', 'room_id', 'user_id', 'message', 'message_type', 'file', 'file_name', 'file_size', 'mime_type', 'thumbnails', 'timestamp'
+        )
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['file_base_url'] = self.request.build_absolute_uri(getattr(settings, 'CHAT_MEDIA_URL', settings.MEDIA_URL))
+        return context
 
 
 class JoinRoomView(APIView):
@@ -123,19 +207,38 @@ class LeaveRoomView(APIView):
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.parsers import MultiPartParser, FormParser
+import hmac
 import logging
 import os
-import uuid
-from django.conf import settings
+import shutil
+import tempfile
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.http import http_date
 
 logger = logging.getLogger(__name__)
 
+ALLOWED_UPLOAD_TYPES = [
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp',
+    'video/mp4', 'video/webm', 'video/quicktime',
+    'audio/mpeg', 'audio/wav', 'audio/ogg',
+    'application/pdf', 'application/msword', 
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'text/plain', 'text/csv'
+]
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_notifications(request):
     """Get user's notifications"""
     try:
-        notifications = Notification.objects.filter(recipient=request.user).order_by('-created_at')
+        # Sender names come from the same query; ordering is applied by the paginator
+        notifications = Notification.objects.filter(recipient=request.user).select_related('sender').only(
+            'id', 'notification_type', 'title', 'message', 'is_read', 'room_name', 'created_at', 'sender__username'
+        )
         
         # Filter by read status if provided
         is_read = request.query_params.get('is_read')
@@ -148,9 +251,11 @@ def get_notifications(request):
         if notification_type:
             notifications = notifications.filter(notification_type=notification_type)
         
-        serializer = NotificationSerializer(notifications, many=True)
-        logger.info(f'User {request.user.username} retrieved {len(notifications)} notifications')
-        return Response(serializer.data)
+        paginator = FeedPagination()
+        page = paginator.paginate_queryset(notifications, request)
+        serializer = NotificationSerializer(page, many=True)
+        logger.info(f'User {request.user.username} retrieved {len(page)} notifications')
+        return paginator.get_paginated_response(serializer.data)
     except Exception as e:
         logger.error(f'Error getting notifications: {str(e)}')
         return Response(
@@ -165,8 +270,13 @@ def mark_notification_read(request, notification_id):
     """Mark a notification as read"""
     try:
         notification = Notification.objects.get(id=notification_id, recipient=request.user)
-        notification.is_read = True
-        notification.save()
+        with transaction.atomic():
+            # Only the request that flips the flag adjusts the counter
+            updated = Notification.objects.filter(id=notification.id, is_read=False).update(is_read=True)
+            if updated:
+                NotificationCounter.decrement(request.user.id, notification.notification_type)
+        if updated:
+            push_unread_counts(request.user.id)
         
         logger.info(f'User {request.user.username} marked notification {notification_id} as read')
         return Response({'message': 'Notification marked as read'})
@@ -188,10 +298,13 @@ def mark_notification_read(request, notification_id):
 def mark_all_notifications_read(request):
     """Mark all notifications as read"""
     try:
-        updated_count = Notification.objects.filter(
-            recipient=request.user, 
-            is_read=False
-        ).update(is_read=True)
+        with transaction.atomic():
+            updated_count = Notification.objects.filter(
+                recipient=request.user, 
+                is_read=False
+            ).update(is_read=True)
+            NotificationCounter.reset(request.user.id)
+        push_unread_counts(request.user.id)
         
         logger.info(f'User {request.user.username} marked {updated_count} notifications as read')
         return Response({'message': f'{updated_count} notifications marked as read'})
@@ -203,13 +316,45 @@ def mark_all_notifications_read(request):
         )
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_unread_counts(request):
+    """Get the user's unread notification counts by type"""
+    try:
+        return Response(NotificationCounter.counts_for(request.user.id))
+    except Exception as e:
+        logger.error(f'Error getting unread notification counts: {str(e)}')
+        return Response(
+            {'error': 'Failed to get unread notification counts'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+def push_unread_counts(user_id):
+    """Send the user's current unread counts to their open WebSockets"""
+    try:
+        event = {
+            'type': 'notification_counts',
+            'counts': NotificationCounter.counts_for(user_id)
+        }
+        with metrics.group_send_seconds.time():
+            async_to_sync(get_channel_layer().group_send)(f'user_{user_id}', event)
+    except Exception as e:
+        logger.error(f'Error pushing unread notification counts: {str(e)}')
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_user_presence(request, username):
     """Get user's presence status"""
     try:
         user = User.objects.get(username=username)
-        presence, created = UserPresence.objects.get_or_create(user=user)
+        state = get_presence_tracker().get(user.id)
+        if state is None:
+            # Not seen by the presence store; fall back to the persisted row
+            presence, created = UserPresence.objects.get_or_create(user=user)
+        else:
+            presence = UserPresence(user=user, **state)
         serializer = UserPresenceSerializer(presence)
         return Response(serializer.data)
     except User.DoesNotExist:
@@ -231,7 +376,7 @@ def get_online_users(request):
     """Get list of online users"""
     try:
         online_users = User.objects.filter(
-            userpresence__is_online=True
+            id__in=get_presence_tracker().online_user_ids()
         ).exclude(id=request.user.id)
         
         serializer = UserSerializer(online_users, many=True)
@@ -269,42 +414,21 @@ class FileUploadView(APIView):
                 )
             
             # Validate file type
-            allowed_types = [
-                'image/jpeg', 'image/png', 'image/gif', 'image/webp',
-                'video/mp4', 'video/webm', 'video/quicktime',
-                'audio/mpeg', 'audio/wav', 'audio/ogg',
-                'application/pdf', 'application/msword', 
-                'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                'text/plain', 'text/csv'
-            ]
-            
-            if file.content_type not in allowed_types:
+            if file.content_type not in ALLOWED_UPLOAD_TYPES:
                 return Response(
                     {'error': 'File type not allowed'}, 
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Generate unique filename
-            file_extension = os.path.splitext(file.name)[1]
-            unique_filename = f"{uuid.uuid4()}{file_extension}"
-            
-            # Create uploads directory if it doesn't exist
-            upload_dir = os.path.join(settings.MEDIA_ROOT, 'chat_files')
-            os.makedirs(upload_dir, exist_ok=True)
-            
-            # Save file
-            file_path = os.path.join(upload_dir, unique_filename)
-            with open(file_path, 'wb+') as destination:
-                for chunk in file.chunks():
-                    destination.write(chunk)
+            # Hash while saving, then store under the content address
+            temp_path = temporary_upload_path()
+            sha256, size = write_hashed(file.chunks(), temp_path)
+            metrics.upload_bytes.labels('direct').inc(size)
+            attachment = store_attachment(temp_path, sha256, size, file.name, file.content_type)
+            record_upload(attachment, request.user)
             
             # Return file information
-            file_info = {
-                'file_name': file.name,
-                'file_size': file.size,
-                'mime_type': file.content_type,
-                'file_url': f"{settings.MEDIA_URL}chat_files/{unique_filename}"
-            }
+            file_info = attachment_file_info(attachment, file.name, file.content_type)
             
             logger.info(f"User {request.user.username} uploaded file: {file.name} ({file.size} bytes)")
             return Response(file_info, status=status.HTTP_201_CREATED)
@@ -314,4 +438,282 @@ class FileUploadView(APIView):
             return Response(
                 {'error': 'Failed to upload file'}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+            )
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_attachment(request, sha256):
+    """Look up stored content by hash so a client can skip uploading it.
+
+    Only content the user uploaded before, or that was sent to one of their
+    rooms, is found; other hashes answer 404 whether or not they are stored.
+    The optional ``size`` query parameter must match the stored size.
+    """
+    try:
+        attachment = Attachment.accessible_to(request.user.id).get(sha256=sha256.lower())
+        size = request.query_params.get('size')
+        if size is not None and str(attachment.size) != size:
+            raise Attachment.DoesNotExist
+        # Restart the grace period of an unsent blob the user is about to reuse
+        AttachmentUpload.objects.filter(attachment=attachment, user=request.user).update(uploaded_at=timezone.now())
+        return Response({
+            'sha256': attachment.sha256,
+            'file_size': attachment.size,
+            'mime_type': attachment.mime_type,
+            'file_url': media_url(attachment.file.name),
+        })
+    except Attachment.DoesNotExist:
+        return Response(
+            {'error': 'Attachment not found'}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    except Exception as e:
+        logger.error(f'Error looking up attachment: {str(e)}')
+        return Response(
+            {'error': 'Failed to look up attachment'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+class MediaView(APIView):
+    """Serve stored attachments and thumbnails to authenticated users.
+
+    Supports single byte ranges, ``ETag``/``If-None-Match`` revalidation and
+    long-lived caching of content-addressed files. The access token may be
+    passed as ``?token=`` for use in media elements. Only members of a room
+    holding a message with the file may fetch it; others get a 404.
+    """
+    authentication_classes = [JWTAuthentication, QueryParamJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, name):
+        path = resolve_media_path(name)
+        if path is None or not can_access_media(request.user, name):
+            return Response({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
+        return serve_media(request, name, path)
+
+
+class ResumableUploadCreateView(APIView):
+    """Start a resumable (tus-style) upload.
+
+    The client declares the file up front, then sends the bytes with PATCH
+    requests to the returned upload URL and finalizes with ``complete/``.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        """Create an upload and return its id and starting offset"""
+        try:
+            file_name = request.data.get('file_name')
+            mime_type = request.data.get('mime_type')
+            try:
+                total_size = int(request.data.get('file_size'))
+            except (TypeError, ValueError):
+                total_size = None
+
+            if not file_name or total_size is None or total_size <= 0:
+                return Response(
+                    {'error': 'file_name and a positive file_size are required'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            max_size = getattr(settings, 'CHAT_RESUMABLE_UPLOAD_MAX_SIZE', 100 * 1024 * 1024)
+            if total_size > max_size:
+                return Response(
+                    {'error': f'File size exceeds {max_size // (1024 * 1024)}MB limit'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            if mime_type not in ALLOWED_UPLOAD_TYPES:
+                return Response(
+                    {'error': 'File type not allowed'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            upload = ChunkedUpload.objects.create(
+                user=request.user,
+                file_name=file_name,
+                mime_type=mime_type,
+                total_size=total_size
+            )
+            os.makedirs(os.path.dirname(upload.partial_path), exist_ok=True)
+            open(upload.partial_path, 'wb').close()
+
+            logger.info(f"User {request.user.username} started upload {upload.id}: {file_name} ({total_size} bytes)")
+            response = Response({
+                'upload_id': str(upload.id),
+                'offset': 0,
+                'file_size': total_size,
+                'upload_url': request.build_absolute_uri(f'{upload.id}/'),
+            }, status=status.HTTP_201_CREATED)
+            response['Upload-Offset'] = '0'
+            response['Upload-Length'] = str(total_size)
+            response['Upload-Expires'] = http_date(upload.expires_at.timestamp())
+            return response
+        except Exception as e:
+            logger.error(f"Error creating upload: {str(e)}")
+            return Response(
+                {'error': 'Failed to create upload'}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class ResumableUploadView(APIView):
+    """Query the offset of an upload (HEAD/GET) or append a chunk (PATCH).
+
+    PATCH bodies are raw bytes with an ``Upload-Offset`` header that must match
+    the stored offset. The body is streamed to disk in fixed-size reads, and
+    whatever arrived before a dropped connection is kept so the client can
+    resume from the new offset. Of concurrent chunks for the same offset only
+    the first to finish is written. Each chunk extends the upload's expiry.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    chunk_size = 64 * 1024
+
+    def get_upload(self, request, upload_id):
+        return ChunkedUpload.objects.get(id=upload_id, user=request.user, expires_at__gt=timezone.now())
+
+    def offset_response(self, upload, response_status=status.HTTP_200_OK):
+        data = None
+        if response_status != status.HTTP_204_NO_CONTENT:
+            data = {
+                'upload_id': str(upload.id),
+                'offset': upload.offset,
+                'file_size': upload.total_size,
+            }
+        response = Response(data, status=response_status)
+        response['Upload-Offset'] = str(upload.offset)
+        response['Upload-Length'] = str(upload.total_size)
+        response['Upload-Expires'] = http_date(upload.expires_at.timestamp())
+        response['Cache-Control'] = 'no-store'
+        return response
+
+    def get(self, request, upload_id):
+        """Return the current offset"""
+        try:
+            return self.offset_response(self.get_upload(request, upload_id))
+        except ChunkedUpload.DoesNotExist:
+            return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    def head(self, request, upload_id):
+        """Return the current offset in headers only"""
+        return self.get(request, upload_id)
+
+    def patch(self, request, upload_id):
+        """Append a chunk at the current offset"""
+        try:
+            upload = self.get_upload(request, upload_id)
+        except ChunkedUpload.DoesNotExist:
+            return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            try:
+                client_offset = int(request.headers.get('Upload-Offset'))
+            except (TypeError, ValueError):
+                return Response(
+                    {'error': 'Upload-Offset header is required'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            if client_offset != upload.offset:
+                response = self.offset_response(upload, status.HTTP_409_CONFLICT)
+                response.data['error'] = 'Upload-Offset does not match the stored offset'
+                return response
+
+            # Stream the body to a scratch file next to the partial file without
+            # buffering it; concurrent requests for the same offset each get
+            # their own, so a losing retry never touches the partial file
+            stream = request.stream
+            remaining = upload.total_size - upload.offset
+            received = 0
+            with tempfile.TemporaryFile(dir=os.path.dirname(upload.partial_path)) as scratch:
+                while stream is not None and received < remaining:
+                    chunk = stream.read(min(self.chunk_size, remaining - received))
+                    if not chunk:
+                        break
+                    scratch.write(chunk)
+                    received += len(chunk)
+                metrics.upload_bytes.labels('resumable').inc(received)
+
+                # Only the writer that started from the stored offset may
+                # advance it and copy its bytes in. The row stays locked until
+                # the copy is done, and a failed copy leaves the offset as it was.
+                new_offset = upload.offset + received
+                expires_at = upload_expiry()
+                with transaction.atomic():
+                    updated = ChunkedUpload.objects.filter(
+                        id=upload.id, offset=upload.offset
+                    ).update(offset=new_offset, updated_at=timezone.now(), expires_at=expires_at)
+                    if updated:
+                        scratch.seek(0)
+                        with open(upload.partial_path, 'r+b') as destination:
+                            destination.seek(upload.offset)
+                            shutil.copyfileobj(scratch, destination, self.chunk_size)
+            if not updated:
+                upload.refresh_from_db()
+                response = self.offset_response(upload, status.HTTP_409_CONFLICT)
+                response.data['error'] = 'Upload was modified concurrently'
+                return response
+
+            upload.offset = new_offset
+            upload.expires_at = expires_at
+            return self.offset_response(upload, status.HTTP_204_NO_CONTENT)
+        except Exception as e:
+            logger.error(f"Error writing chunk for upload {upload_id}: {str(e)}")
+            return Response(
+                {'error': 'Failed to write chunk'}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class ResumableUploadCompleteView(APIView):
+    """Finalize a fully received upload into deduplicated attachment storage"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, upload_id):
+        """Move the assembled file into place and return file information"""
+        try:
+            upload = ChunkedUpload.objects.get(id=upload_id, user=request.user, expires_at__gt=timezone.now())
+        except ChunkedUpload.DoesNotExist:
+            return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            if not upload.is_complete:
+                return Response(
+                    {'error': f'Upload incomplete ({upload.offset}/{upload.total_size} bytes)'}, 
+                    status=status.HTTP_409_CONFLICT
+                )
+
+            # Chunks arrive over several requests, so the assembled file is hashed here
+            sha256 = hash_file(upload.partial_path)
+            attachment = store_attachment(upload.partial_path, sha256, upload.total_size, upload.file_name, upload.mime_type)
+            record_upload(attachment, request.user)
+            upload.delete()
+
+            file_info = attachment_file_info(attachment, upload.file_name, upload.mime_type)
+
+            logger.info(f"User {request.user.username} completed upload {upload_id}: {upload.file_name} ({upload.total_size} bytes)")
+            return Response(file_info, status=status.HTTP_201_CREATED)
+        except Exception as e:
+            logger.error(f"Error completing upload {upload_id}: {str(e)}")
+            return Response(
+                {'error': 'Failed to complete upload'}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+def get_metrics(request):
+    """Prometheus scrape endpoint for this process.
+
+    Requires ``Authorization: Bearer <CHAT_METRICS_TOKEN>`` when a token is
+    configured; without one it is only served in DEBUG.
+    """
+    token = getattr(settings, 'CHAT_METRICS_TOKEN', None)
+    if token:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not hmac.compare_digest(supplied.encode(), token.encode()):
+            return JsonResponse({'error': 'Invalid metrics token'}, status=status.HTTP_401_UNAUTHORIZED)
+    elif not settings.DEBUG:
+        return JsonResponse({'error': 'Metrics are disabled'}, status=status.HTTP_404_NOT_FOUND)
+    return HttpResponse(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
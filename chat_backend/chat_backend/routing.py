@@ -1,14 +1,14 @@
 from django.urls import path
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
 from chat.consumers import ChatConsumer
+from chat.middleware import JWTAuthMiddlewareStack
 
 websocket_urlpatterns = [
     path('ws/chat/<str:room_name>/', ChatConsumer.as_asgi()),
 ]
 
 application = ProtocolTypeRouter({
-    "websocket": AuthMiddlewareStack(
+    "websocket": JWTAuthMiddlewareStack(
         URLRouter(
             websocket_urlpatterns
         )
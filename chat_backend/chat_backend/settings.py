@@ -63,6 +63,7 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE = [
+    'chat.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -181,7 +182,115 @@ SIMPLE_JWT = {
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Chat message persistence
+# When enabled, inbound WebSocket messages are queued and written with
+# bulk_create once the batch is full or the flush interval (seconds) elapses.
+CHAT_WRITE_BEHIND_ENABLED = False
+CHAT_WRITE_BEHIND_BATCH_SIZE = 100
+CHAT_WRITE_BEHIND_FLUSH_INTERVAL = 0.005
+
+# Maximum number of chat operations accepted in a single WebSocket frame;
+# lowered to the smaller of the room and batch bursts in CHAT_RATE_LIMITS
+# while rate limiting is on
+CHAT_MAX_BATCH_OPERATIONS = 100
+
+# Recent messages kept in memory per room and sent to clients on connect
+CHAT_HISTORY_SIZE = 50
+CHAT_HISTORY_MAX_ROOMS = 1000
+
+# Largest attachment accepted through the resumable upload API
+CHAT_RESUMABLE_UPLOAD_MAX_SIZE = 100 * 1024 * 1024  # 100MB
+# Seconds a resumable upload survives without receiving a chunk; expired
+# uploads are deleted with their partial files by 'manage.py cleanup_uploads'
+CHAT_RESUMABLE_UPLOAD_EXPIRY = 24 * 60 * 60
+
+# Seconds an uploaded attachment no message references is kept before
+# 'manage.py cleanup_uploads' deletes it
+CHAT_ATTACHMENT_GRACE_PERIOD = 24 * 60 * 60
+
+# Attachments are served by the authenticated media endpoint at CHAT_MEDIA_URL.
+# Content-addressed files are cached by clients for CHAT_MEDIA_MAX_AGE seconds.
+# Only members of a room holding a message with the file may fetch it.
+# Set CHAT_MEDIA_ACCEL_REDIRECT to an internal nginx location mapped to
+# MEDIA_ROOT to let nginx send file bodies; otherwise daphne streams them
+# through Python (sendfile is only used under WSGI servers).
+CHAT_MEDIA_URL = '/api/auth/media/'
+CHAT_MEDIA_MAX_AGE = 31536000  # 1 year
+CHAT_MEDIA_ACCEL_REDIRECT = None
+
+# Postgres text search configuration for message search. 'simple' does not
+# stem, matching the SQLite FTS5 index used in development.
+CHAT_SEARCH_CONFIG = 'simple'
+
+# Message archive
+# 'manage.py archive_messages' moves messages older than CHAT_ARCHIVE_AFTER_DAYS
+# into compressed per-room, per-month segment files under CHAT_ARCHIVE_ROOT.
+# History requests read them back transparently.
+CHAT_ARCHIVE_AFTER_DAYS = 180
+CHAT_ARCHIVE_ROOT = BASE_DIR / 'archive'
+CHAT_ARCHIVE_CACHE_SEGMENTS = 64
+
+# Prometheus metrics are served per process at /api/auth/metrics/. Scrapers
+# must send 'Authorization: Bearer <CHAT_METRICS_TOKEN>'; without a token the
+# endpoint is only available with DEBUG on.
+CHAT_METRICS_TOKEN = None
+
+# WebSocket rate limits
+# Token buckets given as (tokens per second, burst); None disables a scope.
+# Every frame costs a connection and a user token. Every chat operation costs
+# a room token, and operations sent in a batch frame also cost a token from
+# the user's batch budget, so batches larger than the room or batch burst are
+# refused. Refused frames get an error frame with a retry_after hint in
+# seconds. Buckets are process-local by default; use
+# 'chat.ratelimit.RedisRateLimitBackend' to share them between nodes.
+CHAT_RATE_LIMIT_ENABLED = True
+CHAT_RATE_LIMIT_BACKEND = 'chat.ratelimit.InMemoryRateLimitBackend'
+CHAT_RATE_LIMIT_OPTIONS = {}
+CHAT_RATE_LIMITS = {
+    'connection': (5, 10),
+    'user': (10, 20),
+    'room': (100, 200),
+    'batch': (50, 100),
+}
+
+# Maximum number of room name -> id entries cached per process
+CHAT_ROOM_CACHE_SIZE = 10000
+
+# Maximum number of verified WebSocket access tokens cached per process
+CHAT_AUTH_CACHE_SIZE = 50000
+
+# Thumbnails of image and video messages, rendered in a process pool after
+# the message is broadcast. Each size is the longest side in pixels. Requires
+# Pillow; video poster frames also require ffmpeg.
+CHAT_THUMBNAILS_ENABLED = True
+CHAT_THUMBNAIL_SIZES = [160, 480]
+CHAT_THUMBNAIL_WORKERS = 2
+
+# User presence
+# Connections are tracked in a fast store and expire CHAT_PRESENCE_TTL seconds
+# after their last heartbeat. Changes reach the UserPresence table in batches
+# every CHAT_PRESENCE_FLUSH_INTERVAL seconds.
+CHAT_PRESENCE_BACKEND = 'chat.presence.InMemoryPresenceBackend'
+CHAT_PRESENCE_OPTIONS = {}
+CHAT_PRESENCE_TTL = 60
+CHAT_PRESENCE_FLUSH_INTERVAL = 1.0
+
 # Logging Configuration
+# chat.log.configure_logging applies LOGGING and then moves every configured
+# logger's handlers behind a queue of CHAT_LOG_QUEUE_SIZE records, drained by
+# one listener thread, so request and WebSocket code never waits on log I/O.
+# CHAT_LOG_MESSAGE_SAMPLE_RATE is the fraction of per-message INFO lines kept.
+LOGGING_CONFIG = 'chat.log.configure_logging'
+CHAT_LOG_QUEUE_SIZE = 10000
+CHAT_LOG_MESSAGE_SAMPLE_RATE = 1.0
+
+# Message pipeline tracing
+# A CHAT_TRACE_SAMPLE_RATE fraction of inbound messages is traced through
+# receive, group_send and every recipient's chat_message. Spans are written as
+# JSON lines to CHAT_TRACE_FILE; 'manage.py trace_breakdown' summarizes them.
+CHAT_TRACE_SAMPLE_RATE = 0.01
+CHAT_TRACE_FILE = BASE_DIR / 'logs' / 'traces.jsonl'
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -198,6 +307,10 @@ LOGGING = {
             'format': '{"timestamp": "%(asctime)s", "level": "%(levelname)s", "module": "%(module)s", "message": "%(message)s"}',
             'style': '%',
         },
+        'trace': {
+            'format': '{message}',
+            'style': '{',
+        },
     },
     'filters': {
         'require_debug_true': {
@@ -206,6 +319,10 @@ LOGGING = {
         'require_debug_false': {
             '()': 'django.utils.log.RequireDebugFalse',
         },
+        'sample_messages': {
+            '()': 'chat.log.SamplingFilter',
+            'rate': CHAT_LOG_MESSAGE_SAMPLE_RATE,
+        },
     },
     'handlers': {
         'console': {
@@ -246,6 +363,15 @@ LOGGING = {
             'backupCount': 10,
             'formatter': 'verbose',
         },
+        'trace_file': {
+            'level': 'INFO',
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': CHAT_TRACE_FILE,
+            'maxBytes': 1024 * 1024 * 15,  # 15MB
+            'backupCount': 10,
+            'formatter': 'trace',
+            'delay': True,  # opened on the first sampled trace
+        },
         'mail_admins': {
             'level': 'ERROR',
             'filters': ['require_debug_false'],
@@ -279,10 +405,19 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'chat.websocket.messages': {
+            'filters': ['sample_messages'],
+            'propagate': True,
+        },
         'chat.security': {
             'handlers': ['security_file', 'mail_admins'],
             'level': 'WARNING',
             'propagate': False,
+        },
+        'chat.trace': {
+            'handlers': ['trace_file'],
+            'level': 'INFO',
+            'propagate': False,
         }
     },
 }
@@ -43,6 +43,18 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Shared presence store so every node sees the same online users
+CHAT_PRESENCE_BACKEND = 'chat.presence.RedisPresenceBackend'
+CHAT_PRESENCE_OPTIONS = {
+    'url': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379'),
+}
+
+# Shared rate limit buckets, so room and user limits hold across nodes
+CHAT_RATE_LIMIT_BACKEND = 'chat.ratelimit.RedisRateLimitBackend'
+CHAT_RATE_LIMIT_OPTIONS = {
+    'url': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379'),
+}
+
 # Static files configuration for production
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
@@ -50,6 +62,12 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 # Media files configuration for production
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Internal nginx location serving MEDIA_ROOT, e.g. /protected-media/
+CHAT_MEDIA_ACCEL_REDIRECT = os.environ.get('CHAT_MEDIA_ACCEL_REDIRECT')
+
+# Bearer token Prometheus sends to /api/auth/metrics/
+CHAT_METRICS_TOKEN = os.environ.get('CHAT_METRICS_TOKEN')
+
 # Security settings for production
 SECURE_BROWSER_XSS_FILTER = True
 SECURE_CONTENT_TYPE_NOSNIFF = True
@@ -71,6 +89,10 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 # Logging configuration for production
+# Keep a tenth of the per-message INFO lines; warnings and errors are never sampled
+CHAT_LOG_MESSAGE_SAMPLE_RATE = float(os.environ.get('CHAT_LOG_MESSAGE_SAMPLE_RATE', '0.1'))
+CHAT_TRACE_SAMPLE_RATE = float(os.environ.get('CHAT_TRACE_SAMPLE_RATE', '0.001'))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -83,6 +105,16 @@ LOGGING = {
             'format': '{"timestamp": "%(asctime)s", "level": "%(levelname)s", "module": "%(module)s", "message": "%(message)s"}',
             'style': '%',
         },
+        'trace': {
+            'format': '{message}',
+            'style': '{',
+        },
+    },
+    'filters': {
+        'sample_messages': {
+            '()': 'chat.log.SamplingFilter',
+            'rate': CHAT_LOG_MESSAGE_SAMPLE_RATE,
+        },
     },
     'handlers': {
         'file': {
@@ -101,6 +133,15 @@ LOGGING = {
             'backupCount': 10,
             'formatter': 'json',
         },
+        'trace_file': {
+            'level': 'INFO',
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': CHAT_TRACE_FILE,
+            'maxBytes': 1024 * 1024 * 15,  # 15MB
+            'backupCount': 10,
+            'formatter': 'trace',
+            'delay': True,  # opened on the first sampled trace
+        },
     },
     'loggers': {
         'django': {
@@ -113,6 +154,15 @@ LOGGING = {
             'level': 'INFO',
             'propagate': True,
         },
+        'chat.websocket.messages': {
+            'filters': ['sample_messages'],
+            'propagate': True,
+        },
+        'chat.trace': {
+            'handlers': ['trace_file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
 